@@ -0,0 +1,209 @@
+# Inverted-file (IVF) approximate nearest-neighbour index over the stored embeddings.
+#
+# Vectors are clustered with spherical k-means; a query only scans the n_probe lists
+# whose centroids are closest to it, so search cost is roughly n_probe / n_lists of a
+# full scan. n_probe is the recall/latency knob.
+
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+from unixcoder import top_k_indices
+
+IVF_INDEX_FILE = "embeddings_ivf.npz"
+
+ASSIGN_BLOCK_ROWS = 8192
+
+
+def assign_to_centroids(
+    data: np.ndarray, centroids: np.ndarray, euclidean: bool = False
+) -> np.ndarray:
+    """Returns the highest dot-product (or nearest, with euclidean) centroid for every row.
+
+    Works in bounded-memory blocks. argmin |x - c|^2 is argmax x.c - |c|^2 / 2.
+    """
+    half_norms = 0.5 * np.einsum("ij,ij->i", centroids, centroids) if euclidean else 0.0
+    assignments = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(data[start : start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start : start + len(block)] = np.argmax(
+            block @ centroids.T - half_norms, axis=1
+        )
+    return assignments
+
+
+def spherical_kmeans(
+    data: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0
+) -> np.ndarray:
+    """Clusters unit vectors by cosine similarity. Returns (n_clusters, dim) unit centroids."""
+    return kmeans(data, n_clusters, n_iter=n_iter, seed=seed, spherical=True)
+
+
+def kmeans(
+    data: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0, spherical: bool = False
+) -> np.ndarray:
+    """Lloyd's k-means. Euclidean by default; spherical keeps unit centroids and uses cosine."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignments = assign_to_centroids(data, centroids, euclidean=not spherical)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_clusters)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(data[order], starts[filled], axis=0)
+
+        # Re-seed empty clusters from random points so every list stays usable
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            sums[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+
+        if spherical:
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+        else:
+            centroids = sums / np.maximum(counts, 1)[:, None]
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted lists of (id, vector) grouped by nearest k-means centroid.
+
+    Each list is an (ids, vectors) pair and add() publishes a new tuple of lists in one
+    assignment, so a concurrent search sees every list either before or after the add.
+    """
+
+    # Scores come from the stored float32 vectors, so results need no re-ranking
+    exact_scores = True
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        list_ids: List[np.ndarray],
+        list_vectors: List[np.ndarray],
+        n_probe: int = 8,
+    ):
+        self.centroids = centroids
+        self.lists: Tuple[Tuple[np.ndarray, np.ndarray], ...] = tuple(zip(list_ids, list_vectors))
+        self.n_probe = n_probe
+
+    @property
+    def list_ids(self) -> List[np.ndarray]:
+        return [ids for ids, _ in self.lists]
+
+    @property
+    def list_vectors(self) -> List[np.ndarray]:
+        return [vectors for _, vectors in self.lists]
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self.list_ids)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        ids: np.ndarray,
+        matrix: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_iter: int = 20,
+        train_size: int = 100_000,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Trains centroids on a sample of the matrix and fills the inverted lists."""
+        if n_lists is None:
+            n_lists = max(1, int(4 * math.sqrt(len(ids))))
+        n_lists = min(n_lists, len(ids))
+
+        rng = np.random.default_rng(seed)
+        sample = matrix
+        if len(matrix) > train_size:
+            sample = matrix[np.sort(rng.choice(len(matrix), train_size, replace=False))]
+        centroids = spherical_kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+
+        index = cls(
+            centroids,
+            [np.empty(0, dtype=np.int64) for _ in range(n_lists)],
+            [np.empty((0, matrix.shape[1]), dtype=np.float32) for _ in range(n_lists)],
+        )
+        index.add(ids, matrix)
+        return index
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        """Appends vectors to the list of their nearest centroid."""
+        if len(ids) == 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        assignments = assign_to_centroids(vectors, self.centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=self.n_lists)
+        lists = list(self.lists)
+        start = 0
+        for list_no in np.flatnonzero(counts):
+            rows = order[start : start + counts[list_no]]
+            start += counts[list_no]
+            list_ids, list_vectors = lists[list_no]
+            lists[list_no] = (
+                np.concatenate([list_ids, ids[rows]]),
+                np.concatenate([list_vectors, np.asarray(vectors[rows], dtype=np.float32)]),
+            )
+        self.lists = tuple(lists)
+
+    def retain(self, ids: np.ndarray):
+        """Drops every indexed row whose id isn't in ids."""
+        self.lists = tuple(
+            (list_ids[keep], list_vectors[keep])
+            for list_ids, list_vectors in self.lists
+            for keep in (np.isin(list_ids, ids),)
+        )
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Boolean mask of which ids are already indexed."""
+        indexed = np.concatenate(self.list_ids) if self.list_ids else np.empty(0, dtype=np.int64)
+        return np.isin(ids, indexed)
+
+    def search(
+        self, query_embedding: np.ndarray, top_k: int = 10, n_probe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Returns (id, score) pairs for the top_k rows among the n_probe closest lists."""
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+
+        centroid_scores = self.centroids @ query_embedding
+        probe = top_k_indices(centroid_scores, n_probe)
+
+        lists = self.lists  # one snapshot, so ids and vectors line up
+        ids = np.concatenate([lists[i][0] for i in probe])
+        if len(ids) == 0:
+            return []
+        scores = np.concatenate([lists[i][1] @ query_embedding for i in probe])
+        top_indices = top_k_indices(scores, top_k)
+        return [(int(ids[i]), float(scores[i])) for i in top_indices]
+
+    def save(self, path: str = IVF_INDEX_FILE):
+        offsets = np.cumsum([0] + [len(ids) for ids in self.list_ids])
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                offsets=offsets,
+                ids=np.concatenate(self.list_ids),
+                vectors=np.concatenate(self.list_vectors),
+                n_probe=np.array(self.n_probe),
+            )
+
+    @classmethod
+    def load(cls, path: str = IVF_INDEX_FILE) -> "IVFIndex":
+        with np.load(path) as data:
+            offsets = data["offsets"]
+            ids, vectors = data["ids"], data["vectors"]
+            list_ids = [ids[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+            list_vectors = [vectors[offsets[i] : offsets[i + 1]] for i in range(len(offsets) - 1)]
+            return cls(data["centroids"], list_ids, list_vectors, int(data["n_probe"]))
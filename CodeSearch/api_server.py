@@ -0,0 +1,243 @@
+# Async JSON search API. Run with the same model flag as search.py:
+#
+#   python3 CodeSearch/api_server.py 0
+#   curl -X POST localhost:5003/api/search -d '{"query": "read a json file"}'
+#
+# One event loop holds every in-flight request. Embedding and the vector scan run on
+# a thread pool (concurrent queries still share the embedding micro-batches), and the
+# LLM calls are awaited on a single async HTTP client, so a slow LLM call no longer
+# holds a worker. Score cache reads and writes (SQLite) run on their own small pool,
+# never on the event loop. With RERANKER=cross_encoder the re-ranking forward pass runs on the
+# same thread pool as embedding.
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from llm_client import NO_DEADLINE, AsyncLLMClient, reply_text
+from rankers import LLMRanker
+from search import (
+    BATCH_SCORE_VARIANT,
+    LLM_API_KEY,
+    LLM_BASE_URL,
+    LLM_TIMEOUT,
+    SCORE_FORMAT,
+    SCORE_PARSERS,
+    SCORING_MODE,
+    SCORING_MODES,
+    SINGLE_SCORE_VARIANT,
+    batch_scoring_messages,
+    embedding_store,
+    finish_score,
+    model_choice,
+    parse_batch_scores,
+    ranker,
+    score_cache,
+    score_request,
+    scoring_messages,
+    search_cascade,
+    search_deadline,
+    sort_by_score,
+)
+from search_processing import embedding_batcher, process_user_code_segment, query_cache
+
+API_PORT = int(os.environ.get("API_PORT", 5003))
+# Threads for embedding + scan; above the embedding batch size so batches can fill
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 32))
+# LLM requests in flight across all queries; the rest wait on the semaphore
+ASYNC_LLM_CONCURRENCY = int(os.environ.get("ASYNC_LLM_CONCURRENCY", 64))
+
+async_llm = AsyncLLMClient(
+    LLM_BASE_URL, LLM_API_KEY, pool_size=ASYNC_LLM_CONCURRENCY, timeout=LLM_TIMEOUT
+)
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+# The cache serializes on its own lock, so more threads would only queue there
+cache_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="score-cache")
+
+LLM_SLOTS = web.AppKey("llm_slots", asyncio.Semaphore)
+# Only touched from the event loop, so no lock
+in_flight = 0
+
+
+async def in_cache_thread(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(cache_executor, fn, *args)
+
+
+def cached_scores(user_input: str, snippets: list) -> list:
+    return [score_cache.get(model_choice, user_input, snippet, BATCH_SCORE_VARIANT) for snippet in snippets]
+
+
+def store_scores(user_input: str, snippets: list, scores: list):
+    for snippet, score in zip(snippets, scores):
+        score_cache.put(model_choice, user_input, snippet, score, BATCH_SCORE_VARIANT)
+
+
+async def evaluate_snippet_async(
+    user_input: str, snippet: str, llm_slots: asyncio.Semaphore, retries=3, deadline=NO_DEADLINE
+):
+    """Async evaluate_snippet_no_print: same prompt, parsing, cache and fallback score."""
+    if score_cache is not None:
+        cached_score = await in_cache_thread(
+            score_cache.get, model_choice, user_input, snippet, SINGLE_SCORE_VARIANT
+        )
+        if cached_score is not None:
+            return cached_score
+    async with llm_slots:
+        score = await async_llm.complete(
+            model_choice, scoring_messages(user_input, snippet), parse=SCORE_PARSERS[SCORE_FORMAT],
+            retries=retries, deadline=deadline, **score_request()
+        )
+    return await in_cache_thread(finish_score, user_input, snippet, score, deadline)
+
+
+async def rank_snippets_async(
+    user_input: str, snippets: list, llm_slots: asyncio.Semaphore, mode=SCORING_MODE, deadline=NO_DEADLINE
+):
+    """Async rank_snippets_by_mode; returns (snippet, score) pairs, best first, or the
+    dense order if the deadline passes first."""
+    if mode not in SCORING_MODES:
+        raise ValueError(f"Unknown scoring mode {mode!r}, expected one of {SCORING_MODES}")
+    if mode == "batched" and snippets:
+        scores = [None] * len(snippets)
+        if score_cache is not None:
+            scores = await in_cache_thread(cached_scores, user_input, snippets)
+        uncached = [i for i, score in enumerate(scores) if score is None]
+        new_scores = None
+        if uncached:
+            async with llm_slots:
+                new_scores = await async_llm.complete(
+                    model_choice,
+                    batch_scoring_messages(user_input, [snippets[i] for i in uncached]),
+                    max_tokens=8 * len(uncached) + 16,
+                    parse=lambda choice: parse_batch_scores(reply_text(choice), len(uncached)),
+                    retries=1,
+                    deadline=deadline,
+                )
+        if new_scores is not None:
+            for i, score in zip(uncached, new_scores):
+                scores[i] = score
+            if score_cache is not None:
+                await in_cache_thread(store_scores, user_input, [snippets[i] for i in uncached], new_scores)
+        if not uncached or new_scores is not None or deadline.expired():
+            return sort_by_score(snippets, scores)
+        print("Falling back to per-snippet scoring.")
+
+    if mode == "sequential":
+        scores = []
+        for snippet in snippets:
+            scores.append(await evaluate_snippet_async(user_input, snippet, llm_slots, deadline=deadline))
+        return sort_by_score(snippets, scores)
+    tasks = [
+        asyncio.ensure_future(evaluate_snippet_async(user_input, snippet, llm_slots, deadline=deadline))
+        for snippet in snippets
+    ]
+    if not tasks:
+        return []
+    # Calls still waiting at the deadline are cancelled; their snippets keep the dense order
+    done, pending = await asyncio.wait(tasks, timeout=deadline.wait_timeout())
+    for task in pending:
+        task.cancel()
+    return sort_by_score(snippets, [task.result() if task in done else None for task in tasks])
+
+
+def retrieve_blocking(user_input: str):
+    embedding_store.refresh()
+    return search_cascade.prepare(user_input, process_user_code_segment)
+
+
+async def search_handler(request: web.Request) -> web.Response:
+    """POST {"query": ..., "rerank": true, "deadline_ms": ...}, or GET ?query=...
+
+    Returns both rankings and the stage timings. deadline_ms overrides SEARCH_DEADLINE.
+    """
+    if request.method == "POST":
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+    else:
+        body = dict(request.query)
+        body["rerank"] = body.get("rerank", "1") not in ("0", "false")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    user_input = body.get("query")
+    if not isinstance(user_input, str) or not user_input.strip():
+        raise web.HTTPBadRequest(text='"query" must be a non-empty string')
+
+    try:
+        deadline_ms = body.get("deadline_ms")
+        deadline = search_deadline(None if deadline_ms is None else float(deadline_ms) / 1000)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text='"deadline_ms" must be a number')
+
+    global in_flight
+    in_flight += 1
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(inference_executor, retrieve_blocking, user_input)
+        started = time.perf_counter()
+        if body.get("rerank", True):
+            snippets = search_cascade.llm_snippets(result)
+            if isinstance(ranker, LLMRanker):
+                result.llm_results = await rank_snippets_async(
+                    user_input, snippets, request.app[LLM_SLOTS], deadline=deadline
+                )
+            else:
+                result.llm_results = await loop.run_in_executor(
+                    inference_executor, ranker.rank, user_input, snippets, deadline
+                )
+        search_cascade.record(result, 1000 * (time.perf_counter() - started))
+    finally:
+        in_flight -= 1
+
+    return web.json_response({
+        "query": user_input,
+        "results": [
+            {"id": idx, "snippet": snippet, "score": float(score)}
+            for (idx, _), (snippet, score) in zip(result.candidates, result.snippets)
+        ],
+        "llm_results": [
+            {"snippet": snippet, "score": None if score is None else float(score)}
+            for snippet, score in result.llm_results or []
+        ],
+        "timings": result.timings,
+    })
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.json_response({
+        "in_flight": in_flight,
+        "embedding_batcher": embedding_batcher.metrics(),
+        "query_cache": {"hits": query_cache.hits, "misses": query_cache.misses},
+        "score_cache": await in_cache_thread(score_cache.stats) if score_cache is not None else None,
+        "cascade": search_cascade.metrics(),
+        "llm": async_llm.stats(),
+    })
+
+
+async def on_startup(app: web.Application):
+    # Created inside the running loop it will be awaited on
+    app[LLM_SLOTS] = asyncio.Semaphore(ASYNC_LLM_CONCURRENCY)
+
+
+async def on_cleanup(app: web.Application):
+    await async_llm.close()
+    inference_executor.shutdown(wait=False)
+    cache_executor.shutdown(wait=True)
+
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.router.add_post("/api/search", search_handler)
+    app.router.add_get("/api/search", search_handler)
+    app.router.add_get("/api/metrics", metrics_handler)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), port=API_PORT)
@@ -23,13 +23,16 @@ import logging
 import os
 import pickle
 import random
+import time
 import torch
 import json
 import numpy as np
+from functools import partial
 
-from search import rank_snippets_no_print
-
+from cross_encoder import CROSS_ENCODER_NEGATIVES, CrossEncoder
 from model import Model
+from rankers import RANKERS, SCORING_MODES, CrossEncoderRanker, LLMRanker
+from unixcoder import UniXcoder, blocked_top_k
 from torch.nn import CrossEntropyLoss, MSELoss
 from torch.optim import AdamW
 from torch.utils.data import DataLoader, Dataset, SequentialSampler, RandomSampler, TensorDataset
@@ -149,8 +152,27 @@ def set_seed(seed=42):
     torch.backends.cudnn.deterministic = True
 
 
-def train(args, model, tokenizer):
-    """ Train the model """
+def bi_encoder_scores(model, code_inputs, nl_inputs):
+    """(nl, code) similarities for every pair in the batch, scaled for the softmax, and the
+    column of each query's own code."""
+    code_vec = model(code_inputs=code_inputs)
+    nl_vec = model(nl_inputs=nl_inputs)
+    scores = torch.einsum("ab,cb->ac", nl_vec, code_vec) * 20
+    return scores, torch.arange(code_inputs.size(0), device=scores.device)
+
+
+def cross_encoder_scores(cross_encoder, code_inputs, nl_inputs, n_negatives=CROSS_ENCODER_NEGATIVES):
+    """Cross-encoder logits for each query's own code (column 0) and n_negatives other codes
+    from the batch, so a batch costs batch_size * (1 + n_negatives) forward passes."""
+    scores = cross_encoder.pair_logits(nl_inputs, code_inputs, n_negatives=n_negatives)
+    return scores, torch.zeros(scores.size(0), dtype=torch.long, device=scores.device)
+
+
+def train(args, model, tokenizer, rankers, batch_scores=bi_encoder_scores, retriever=None,
+          checkpoint_prefix='checkpoint-best-mrr'):
+    """ Train the model with in-batch negatives. batch_scores(model, code_inputs, nl_inputs)
+    gives each query's logits and the column of its positive; retriever is the bi-encoder evaluation retrieves with
+    (model itself by default) before rankers re-rank its top 10. """
     # get training dataset
     train_dataset = TextDataset(tokenizer, args, args.train_data_file)
     train_sampler = RandomSampler(train_dataset)
@@ -182,15 +204,10 @@ def train(args, model, tokenizer):
             # get inputs
             code_inputs = batch[0].to(args.device)
             nl_inputs = batch[1].to(args.device)
-            # get code and nl vectors
-            code_vec = model(code_inputs=code_inputs)
-            nl_vec = model(nl_inputs=nl_inputs)
-
             # calculate scores and loss
-            scores = torch.einsum("ab,cb->ac", nl_vec, code_vec)
+            scores, labels = batch_scores(model, code_inputs, nl_inputs)
             loss_fct = CrossEntropyLoss()
-            loss = loss_fct(
-                scores*20, torch.arange(code_inputs.size(0), device=scores.device))
+            loss = loss_fct(scores, labels)
 
             # report loss
             tr_loss += loss.item()
@@ -210,8 +227,8 @@ def train(args, model, tokenizer):
             scheduler.step()
 
         # evaluate
-        results = evaluate(args, model, tokenizer,
-                           args.eval_data_file, eval_when_training=True)
+        results = evaluate(args, retriever or model, tokenizer,
+                           args.eval_data_file, rankers, eval_when_training=True)
         for key, value in results.items():
             logger.info("  %s = %s", key, round(value, 4))
 
@@ -222,7 +239,6 @@ def train(args, model, tokenizer):
             logger.info("  Best mrr:%s", round(best_mrr, 4))
             logger.info("  "+"*"*20)
 
-            checkpoint_prefix = 'checkpoint-best-mrr'
             output_dir = os.path.join(
                 args.output_dir, '{}'.format(checkpoint_prefix))
             if not os.path.exists(output_dir):
@@ -233,7 +249,41 @@ def train(args, model, tokenizer):
             logger.info("Saving model checkpoint to %s", output_dir)
 
 
-def evaluate(args, model, tokenizer, file_name, eval_when_training=False):
+def rerank_top_10(ranker, nl_strings, sort_ids, code_strings):
+    """Re-orders each query's top 10 with ranker; returns the new orders and milliseconds per query."""
+    rankings = []
+    latencies = []
+    for nl_string, sort_id in zip(nl_strings, sort_ids):
+        snippets = [code_strings[idx] for idx in sort_id[:10]]
+        top_10_map = {code_strings[idx]: idx for idx in sort_id[:10]}
+        start = time.perf_counter()
+        ranked = ranker.rank(nl_string, snippets)
+        latencies.append(1000 * (time.perf_counter() - start))
+        rankings.append([top_10_map[snippet] for snippet, _ in ranked])
+    return rankings, latencies
+
+
+def mean_reciprocal_rank(rankings, nl_urls, code_urls):
+    ranks = []
+    for url, top_10 in zip(nl_urls, rankings):
+        rank = 0
+        find = False
+        for idx in top_10[:10]:
+            if find is False:
+                rank += 1
+            if code_urls[idx] == url:
+                find = True
+        if find:
+            ranks.append(1/rank)
+        else:
+            ranks.append(0)
+    return float(np.mean(ranks))
+
+
+def evaluate(args, model, tokenizer, file_name, rankers, eval_when_training=False):
+    """MRR of the bi-encoder's top 10 ("dense_mrr") and, side by side, MRR and per-query
+    latency after each ranker re-orders it. eval_mrr is the first ranker's MRR, or
+    dense_mrr when rankers is empty."""
     query_dataset = TextDataset(tokenizer, args, file_name)
     query_sampler = SequentialSampler(query_dataset)
     query_dataloader = DataLoader(
@@ -268,10 +318,8 @@ def evaluate(args, model, tokenizer, file_name, eval_when_training=False):
     code_vecs = np.concatenate(code_vecs, 0)
     nl_vecs = np.concatenate(nl_vecs, 0)
 
-    scores = np.matmul(nl_vecs, code_vecs.T)
-
-    sort_ids = np.argsort(
-        scores, axis=-1, kind='quicksort', order=None)[:, ::-1]
+    # only the top 10 are re-ranked, so never sort or hold the full score matrix
+    sort_ids, _ = blocked_top_k(nl_vecs, code_vecs, 10)
 
     nl_urls = []
     nl_strings = []
@@ -285,41 +333,38 @@ def evaluate(args, model, tokenizer, file_name, eval_when_training=False):
         code_urls.append(example.url)
         code_strings.append(example.function)
 
-    new_ranked_snippets = []
-    for nl_string, sort_id in zip(nl_strings, sort_ids):
-        code_strings_for_llm = []
-        top_10_map = {}
-        for idx in sort_id[:10]:
-            code_strings_for_llm.append(code_strings[idx])
-            top_10_map[code_strings[idx]] = idx
-
-        new_top_10 = []
-        for snippet, _ in rank_snippets_no_print(nl_string, code_strings_for_llm):
-            new_top_10.append(top_10_map.get(snippet))
-        new_ranked_snippets.append([new_top_10])
-    new_ranked_snippets = np.concatenate(new_ranked_snippets, axis=0)
-
-    ranks = []
-    for url, top_10 in zip(nl_urls, new_ranked_snippets):
-        rank = 0
-        find = False
-        for idx in top_10[:10]:
-            if find is False:
-                rank += 1
-            if code_urls[idx] == url:
-                find = True
-        if find:
-            ranks.append(1/rank)
-        else:
-            ranks.append(0)
-
     result = {
-        "eval_mrr": float(np.mean(ranks))
+        "dense_mrr": mean_reciprocal_rank([sort_id[:10] for sort_id in sort_ids], nl_urls, code_urls)
     }
+    for ranker in rankers:
+        rankings, latencies = rerank_top_10(ranker, nl_strings, sort_ids, code_strings)
+        result[f"{ranker.name}_mrr"] = mean_reciprocal_rank(rankings, nl_urls, code_urls)
+        result[f"{ranker.name}_latency_ms"] = float(np.mean(latencies))
+        result[f"{ranker.name}_p95_latency_ms"] = float(np.percentile(latencies, 95))
+    result["eval_mrr"] = result[f"{rankers[0].name}_mrr"] if rankers else result["dense_mrr"]
+    if any(isinstance(ranker, LLMRanker) for ranker in rankers):
+        from search import score_cache
+        if score_cache is not None:
+            logger.info("  LLM score cache: %s", score_cache.stats())
 
     return result
 
 
+def build_rankers(args, names):
+    """Re-rankers for the given RANKERS names, in RANKERS order. search is only imported
+    (loading its models, index and LLM client) when the LLM ranker is asked for."""
+    rankers = []
+    if "llm" in names:
+        from search import rank_snippets_by_mode
+        rankers.append(LLMRanker(rank_snippets_by_mode, mode=args.scoring_mode))
+    if "cross_encoder" in names:
+        checkpoint = args.cross_encoder_checkpoint or os.path.join(
+            args.output_dir, 'checkpoint-best-cross-encoder/model.bin')
+        rankers.append(CrossEncoderRanker(CrossEncoder.load(
+            checkpoint, model_name=args.model_name_or_path, device=args.device)))
+    return rankers
+
+
 def main():
     parser = argparse.ArgumentParser()
 
@@ -349,6 +394,9 @@ def main():
 
     parser.add_argument("--do_train", action='store_true',
                         help="Whether to run training.")
+    parser.add_argument("--do_train_cross_encoder", action='store_true',
+                        help="Whether to train the cross-encoder re-ranker on the same data, "
+                             "saved to checkpoint-best-cross-encoder.")
     parser.add_argument("--do_eval", action='store_true',
                         help="Whether to run eval on the dev set.")
     parser.add_argument("--do_test", action='store_true',
@@ -369,6 +417,19 @@ def main():
     parser.add_argument("--num_train_epochs", default=1, type=int,
                         help="Total number of training epochs to perform.")
 
+    parser.add_argument("--scoring_mode", default="sequential", choices=SCORING_MODES,
+                        help="How the LLM scores the top 10: one call per snippet, parallel calls "
+                             "(pool size from LLM_CONCURRENCY) or a single batched prompt.")
+    parser.add_argument("--reranker", default="llm", choices=RANKERS + ("both",),
+                        help="What re-ranks the top 10 at eval/test; with both, MRR and latency "
+                             "of each are reported side by side.")
+    parser.add_argument("--cross_encoder_checkpoint", default=None, type=str,
+                        help="Cross-encoder model.bin to evaluate; defaults to the one "
+                             "--do_train_cross_encoder saves in output_dir.")
+    parser.add_argument("--cross_encoder_negatives", default=CROSS_ENCODER_NEGATIVES, type=int,
+                        help="Other codes from the batch each query is scored against when "
+                             "training the cross-encoder.")
+
     parser.add_argument('--seed', type=int, default=42,
                         help="random seed for initialization")
 
@@ -398,9 +459,26 @@ def main():
     if args.n_gpu > 1:
         model = torch.nn.DataParallel(model)
 
+    reranker_names = RANKERS if args.reranker == "both" else (args.reranker,)
+
     # Training
     if args.do_train:
-        train(args, model, tokenizer)
+        train_names = reranker_names
+        if args.do_train_cross_encoder and "cross_encoder" in reranker_names:
+            # its checkpoint is written by the cross-encoder training below
+            logger.warning("The cross-encoder is trained after the bi-encoder; "
+                           "bi-encoder epochs are scored without it")
+            train_names = tuple(name for name in reranker_names if name != "cross_encoder")
+        train(args, model, tokenizer, build_rankers(args, train_names))
+
+    if args.do_train_cross_encoder:
+        cross_encoder = CrossEncoder(UniXcoder(args.model_name_or_path)).to(args.device)
+        train(args, cross_encoder, tokenizer, [CrossEncoderRanker(cross_encoder)], retriever=model,
+              batch_scores=partial(cross_encoder_scores, n_negatives=args.cross_encoder_negatives),
+              checkpoint_prefix='checkpoint-best-cross-encoder')
+
+    if args.do_eval or args.do_test:
+        rankers = build_rankers(args, reranker_names)
 
     # Evaluation
     results = {}
@@ -412,7 +490,7 @@ def main():
             model_to_load = model.module if hasattr(model, 'module') else model
             model_to_load.load_state_dict(torch.load(output_dir))
         model.to(args.device)
-        result = evaluate(args, model, tokenizer, args.eval_data_file)
+        result = evaluate(args, model, tokenizer, args.eval_data_file, rankers=rankers)
         logger.info("***** Eval results *****")
         for key in sorted(result.keys()):
             logger.info("  %s = %s", key, str(round(result[key], 3)))
@@ -425,7 +503,7 @@ def main():
             model_to_load = model.module if hasattr(model, 'module') else model
             model_to_load.load_state_dict(torch.load(output_dir))
         model.to(args.device)
-        result = evaluate(args, model, tokenizer, args.test_data_file)
+        result = evaluate(args, model, tokenizer, args.test_data_file, rankers=rankers)
         logger.info("***** Eval results *****")
         for key in sorted(result.keys()):
             logger.info("  %s = %s", key, str(round(result[key], 3)))
@@ -0,0 +1,175 @@
+# Multi-stage retrieval: a cheap wide first pass, a cheaper re-score, then the LLM on a few.
+#
+#   1. retrieve  top k1 from the store (flat, quantized or ANN), fused with BM25 when given
+#   2. rescore   exact float32 ("exact", only after approximate retrieval) or doc+code
+#                similarity ("code") down to k2
+#   3. llm       LLM relevance scores for the best k3 of those
+#
+# Raising k1/k2 buys recall; k3 is the number of LLM calls per request.
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from embedding_store import EmbeddingStore
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+
+RESCORE_MODES = ("none", "exact", "code")
+STAGES = ("embed", "retrieve", "rescore", "fetch", "llm")
+
+
+class CascadeResult:
+    """Output of one cascade run; timings are milliseconds per stage plus "total"."""
+
+    def __init__(
+        self,
+        candidates: List[Tuple[int, float]],
+        snippets: List[Tuple[str, float]],
+        llm_results: Optional[list],
+        timings: Dict[str, float],
+    ):
+        self.candidates = candidates  # (id, score) after the rescore stage, k2 long
+        self.snippets = snippets  # (code_string, score) for the same rows
+        self.llm_results = llm_results  # ranker output for the top k3, or None
+        self.timings = timings
+
+
+class SearchCascade:
+    """Runs the three stages for a query and keeps per-request stage timings."""
+
+    def __init__(
+        self,
+        store: EmbeddingStore,
+        lexical_index: Optional[LexicalIndex] = None,
+        k1: int = 200,
+        k2: int = 10,
+        k3: int = 10,
+        rescore_mode: str = "exact",
+        code_weight: float = 0.3,
+        n_probe: Optional[int] = None,
+        history_size: int = 1000,
+    ):
+        if rescore_mode not in RESCORE_MODES:
+            raise ValueError(f"Unknown rescore mode {rescore_mode!r}, expected one of {RESCORE_MODES}")
+        if not k1 >= k2 >= k3:
+            raise ValueError(f"Cascade depths must satisfy k1 >= k2 >= k3, got {k1}, {k2}, {k3}")
+        self.store = store
+        self.lexical_index = lexical_index
+        self.k1, self.k2, self.k3 = k1, k2, k3
+        self.rescore_mode = rescore_mode
+        self.code_weight = code_weight
+        self.n_probe = n_probe
+        self.history: "deque[Dict[str, float]]" = deque(maxlen=history_size)
+        self._history_lock = threading.Lock()
+
+    def retrieve(
+        self, user_input: str, query_embedding: np.ndarray
+    ) -> Tuple[List[Tuple[int, float]], List[int]]:
+        """Top k1 candidates, plus the BM25 ranking they were fused with (empty without BM25)."""
+        dense = self.store.search(query_embedding, top_k=self.k1, n_probe=self.n_probe)
+        if self.lexical_index is None:
+            return dense, []
+        lexical = [idx for idx, _ in self.lexical_index.search(user_input, top_k=self.k1)]
+        fused = reciprocal_rank_fusion([[idx for idx, _ in dense], lexical])
+        return fused[: self.k1], lexical
+
+    def rescore(
+        self,
+        query_embedding: np.ndarray,
+        candidates: List[Tuple[int, float]],
+        lexical: Optional[List[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Re-ranks the candidates down to k2 using the vectors of the configured mode.
+
+        "exact" is skipped when the store's scores are already exact and there is no
+        lexical ranking to re-fuse with.
+        """
+        if self.rescore_mode == "none" or (
+            self.rescore_mode == "exact" and self.store.exact_scores and not lexical
+        ):
+            return candidates[: self.k2]
+        ids = [idx for idx, _ in candidates]
+        rescored = self.store.exact_rescore(query_embedding, ids)
+        if self.rescore_mode == "code":
+            code = self.store.code_scores(query_embedding, ids)
+            w = self.code_weight
+            # Rows without a code vector keep their docstring score
+            rescored = [(idx, (1 - w) * score + w * code.get(idx, score)) for idx, score in rescored]
+            rescored.sort(key=lambda x: x[1], reverse=True)
+        if lexical:
+            # Fuse again so identifier matches aren't undone by the dense re-score
+            candidate_ids = set(ids)
+            rescored = reciprocal_rank_fusion(
+                [[idx for idx, _ in rescored], [idx for idx in lexical if idx in candidate_ids]]
+            )
+        return rescored[: self.k2]
+
+    def prepare(self, user_input: str, embed: Callable[[str], np.ndarray]) -> CascadeResult:
+        """Runs every stage before the LLM. Timings are not recorded until record() is called."""
+        timings: Dict[str, float] = {}
+        last = time.perf_counter()
+
+        def lap(stage: str):
+            nonlocal last
+            now = time.perf_counter()
+            timings[stage] = 1000 * (now - last)
+            last = now
+
+        query_embedding = embed(user_input)
+        lap("embed")
+        candidates, lexical = self.retrieve(user_input, query_embedding)
+        lap("retrieve")
+        candidates = self.rescore(query_embedding, candidates, lexical)
+        lap("rescore")
+        code_strings = self.store.get_code_strings([idx for idx, _ in candidates])
+        candidates = [(idx, score) for idx, score in candidates if idx in code_strings]
+        snippets = [(code_strings[idx], score) for idx, score in candidates]
+        lap("fetch")
+        return CascadeResult(candidates, snippets, None, timings)
+
+    def llm_snippets(self, result: CascadeResult) -> List[str]:
+        """The top k3 snippets of a prepared result, the ones the LLM scores."""
+        return [snippet for snippet, _ in result.snippets[: self.k3]]
+
+    def record(self, result: CascadeResult, llm_ms: float = 0.0):
+        """Adds the LLM stage time and stores the request's timings."""
+        result.timings["llm"] = llm_ms
+        result.timings["total"] = sum(result.timings[stage] for stage in STAGES)
+        with self._history_lock:
+            self.history.append(result.timings)
+
+    def run(
+        self,
+        user_input: str,
+        embed: Callable[[str], np.ndarray],
+        rank: Optional[Callable[[str, List[str]], list]] = None,
+    ) -> CascadeResult:
+        """Embeds the query, runs the stages, and scores the top k3 with rank if given."""
+        result = self.prepare(user_input, embed)
+        started = time.perf_counter()
+        if rank is not None:
+            result.llm_results = rank(user_input, self.llm_snippets(result))
+        self.record(result, 1000 * (time.perf_counter() - started))
+        return result
+
+    def metrics(self) -> Dict[str, object]:
+        """Mean and p95 milliseconds per stage over the recorded requests."""
+        with self._history_lock:
+            history = list(self.history)
+        summary: Dict[str, object] = {
+            "requests": len(history),
+            "k1": self.k1,
+            "k2": self.k2,
+            "k3": self.k3,
+            "rescore_mode": self.rescore_mode,
+        }
+        for stage in STAGES + ("total",):
+            values = [timings[stage] for timings in history]
+            summary[f"{stage}_ms"] = {
+                "mean": float(np.mean(values)) if values else 0.0,
+                "p95": float(np.percentile(values, 95)) if values else 0.0,
+            }
+        return summary
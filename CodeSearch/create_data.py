@@ -1,19 +1,99 @@
-import sqlite3
+import argparse
 
+from ann_index import IVF_INDEX_FILE, IVFIndex
 from data_processing import (
     DB_FILE,
-    create_code_search_net_dataset,
     create_table,
+    iter_code_search_net,
+    load_checkpoint,
+    load_embeddings,
     process_data,
 )
+from embedding_file import export_embeddings, mmap_exists, open_embeddings
+from lexical_index import build_lexical_index
+from pq_index import PQ_INDEX_FILE, PQIndex
+from quantization import QUANTIZATION_DTYPES, QUANTIZER_FILE, ScalarQuantizer, export_quantized
+from storage import connect
 
 slice_size = 10000
 if __name__ == "__main__":
-    with sqlite3.connect(DB_FILE) as conn:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slice_size", default=slice_size, type=int,
+                        help="Number of CodeSearchNet functions to index.")
+    parser.add_argument("--all", action="store_true",
+                        help="Index every CodeSearchNet python function, ignoring --slice_size.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Stream the dataset from the hub instead of reading the local arrow cache.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted build from its last committed chunk.")
+    parser.add_argument("--commit_batches", default=64, type=int,
+                        help="Commit (and checkpoint) after this many batches of 16.")
+    parser.add_argument("--embed_code", action="store_true",
+                        help="Also embed each function body for hybrid doc/code scoring (CODE_WEIGHT).")
+    parser.add_argument("--cpu_mode", default="pipeline", choices=["pipeline", "threads"],
+                        help="CPU indexing: batched multi-process pipeline, or the per-row thread pool.")
+    parser.add_argument("--export_mmap", action="store_true",
+                        help="Write the vectors to embeddings.npy so search workers can memory-map them.")
+    parser.add_argument("--drop_blobs", action="store_true",
+                        help="With --export_mmap, clear the SQLite BLOBs and keep only code_string text there.")
+    parser.add_argument("--quantize", default=None, choices=QUANTIZATION_DTYPES,
+                        help="Train a scalar quantizer (and encode the --export_mmap file) for "
+                             "EMBEDDING_QUANTIZATION=1 search.")
+    parser.add_argument("--build_ivf", action="store_true",
+                        help="Build the IVF approximate nearest-neighbour index next to embeddings.db.")
+    parser.add_argument("--ivf_lists", default=None, type=int,
+                        help="Number of IVF lists (default 4 * sqrt(rows)).")
+    parser.add_argument("--ivf_nprobe", default=8, type=int,
+                        help="Default number of lists scanned per query.")
+    parser.add_argument("--build_bm25", action="store_true",
+                        help="Add new rows to the BM25 identifier index (search with BM25=1).")
+    parser.add_argument("--build_pq", action="store_true",
+                        help="Build the product-quantization index (search with ANN_INDEX=pq).")
+    parser.add_argument("--pq_subvectors", default=96, type=int,
+                        help="PQ bytes per vector; must divide the embedding dimension.")
+    args = parser.parse_args()
+
+    with connect(DB_FILE) as conn:
         cursor = conn.cursor()
         create_table(cursor)
-        data_points = create_code_search_net_dataset(slice_size=slice_size)
-        if data_points:
-            process_data(data_points, cursor)
+        slice_size = None if args.all else args.slice_size
+        start_id = load_checkpoint(cursor) if args.resume else 0
+        if start_id:
+            print(f"Resuming from id {start_id}")
+        records = iter_code_search_net(
+            slice_size=slice_size, streaming=args.streaming, start_id=start_id
+        )
+        total = None if slice_size is None else max(0, slice_size - start_id)
+        process_data(
+            records, cursor, cpu_mode=args.cpu_mode, total=total,
+            commit_batches=args.commit_batches, embed_code=args.embed_code,
+        )
         cursor.execute("SELECT COUNT(*) FROM embeddings")
         conn.commit()
+        if args.build_bm25:
+            print(f"Added {build_lexical_index(cursor)} rows to the BM25 index")
+            conn.commit()
+        if args.export_mmap:
+            export_embeddings(cursor, drop_blobs=args.drop_blobs)
+            conn.commit()
+
+    if args.quantize:
+        _, matrix = load_embeddings()
+        quantizer = ScalarQuantizer.train(matrix, args.quantize)
+        quantizer.save(QUANTIZER_FILE)
+        print(f"Saved {args.quantize} quantizer ({quantizer.bytes_per_vector} bytes/vector) to {QUANTIZER_FILE}")
+        if mmap_exists():
+            print(f"Wrote {export_quantized(quantizer, open_embeddings()[1])}")
+
+    if args.build_ivf:
+        ids, matrix = load_embeddings()
+        index = IVFIndex.build(ids, matrix, n_lists=args.ivf_lists)
+        index.n_probe = args.ivf_nprobe
+        index.save(IVF_INDEX_FILE)
+        print(f"Built IVF index with {index.n_lists} lists over {len(index)} embeddings")
+
+    if args.build_pq:
+        ids, matrix = load_embeddings()
+        index = PQIndex.build(ids, matrix, n_subvectors=args.pq_subvectors)
+        index.save(PQ_INDEX_FILE)
+        print(f"Built PQ index over {len(index)} embeddings ({index.bytes_per_vector} bytes/vector)")
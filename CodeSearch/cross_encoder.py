@@ -0,0 +1,115 @@
+# Cross-encoder re-ranker built on the UniXcoder encoder.
+#
+# The bi-encoder embeds the query and the code separately; the cross-encoder reads
+# them as one sequence, [CLS] <encoder-only> [SEP] query [SEP] code [SEP], so every
+# query token attends to every code token. A linear head on the mean-pooled output
+# gives a relevance logit. The top snippets of a query are scored in one batched
+# forward pass, which takes tens of milliseconds on CPU rather than seconds of LLM
+# calls. Train it with `benchmarking.py --do_train_cross_encoder`.
+
+import random
+from typing import List, Optional
+
+import torch
+import torch.nn as nn
+from unixcoder import UniXcoder
+
+from data_processing import MODEL_NAME, pad_token_ids
+
+CROSS_ENCODER_MAX_LENGTH = 512
+CROSS_ENCODER_QUERY_LENGTH = 128
+CROSS_ENCODER_BATCH_SIZE = 16
+CROSS_ENCODER_NEGATIVES = 3
+
+
+class CrossEncoder(nn.Module):
+    """UniXcoder over (query, snippet) pairs with a single-logit relevance head."""
+
+    def __init__(
+        self,
+        encoder: UniXcoder,
+        max_length: int = CROSS_ENCODER_MAX_LENGTH,
+        query_length: int = CROSS_ENCODER_QUERY_LENGTH,
+    ):
+        super().__init__()
+        self.encoder = encoder
+        self.head = nn.Linear(encoder.config.hidden_size, 1)
+        self.max_length = max_length
+        self.query_length = query_length
+
+    @property
+    def pad_token_id(self) -> int:
+        return self.encoder.config.pad_token_id
+
+    def content_ids(self, text: str) -> List[int]:
+        tokenizer = self.encoder.tokenizer
+        return tokenizer.convert_tokens_to_ids(tokenizer.tokenize(text))
+
+    def pair_ids(self, query_ids: List[int], code_ids: List[int]) -> List[int]:
+        """[CLS] <encoder-only> [SEP] query [SEP] code [SEP], truncated to max_length."""
+        tokenizer = self.encoder.tokenizer
+        header = tokenizer.convert_tokens_to_ids([tokenizer.cls_token, "<encoder-only>", tokenizer.sep_token])
+        sep = tokenizer.sep_token_id
+        query_ids = query_ids[: self.query_length]
+        code_ids = code_ids[: self.max_length - len(header) - len(query_ids) - 2]
+        return header + query_ids + [sep] + code_ids + [sep]
+
+    def forward(self, source_ids: torch.Tensor) -> torch.Tensor:
+        """Relevance logits, one per padded pair sequence."""
+        _, pooled = self.encoder(source_ids)
+        return self.head(pooled).squeeze(-1)
+
+    def logits(self, pairs: List[List[int]]) -> torch.Tensor:
+        device = next(self.parameters()).device
+        source_ids = torch.tensor(pad_token_ids(pairs, self.pad_token_id), device=device)
+        return self(source_ids)
+
+    def pair_logits(
+        self, nl_inputs: torch.Tensor, code_inputs: torch.Tensor, n_negatives: int = CROSS_ENCODER_NEGATIVES
+    ) -> torch.Tensor:
+        """(queries, 1 + n_negatives) logits for padded benchmarking.TextDataset rows. Column 0
+        pairs each query with its own code, the rest with codes sampled from the other rows."""
+        queries = [self.strip_special(row) for row in nl_inputs.tolist()]
+        codes = [self.strip_special(row) for row in code_inputs.tolist()]
+        n_negatives = min(n_negatives, len(codes) - 1)
+        pairs = []
+        for i, query in enumerate(queries):
+            negatives = [(i + offset) % len(codes) for offset in random.sample(range(1, len(codes)), n_negatives)]
+            pairs.extend(self.pair_ids(query, codes[j]) for j in [i] + negatives)
+        return self.logits(pairs).view(len(queries), 1 + n_negatives)
+
+    def strip_special(self, row: List[int]) -> List[int]:
+        """Content ids of a [CLS] <encoder-only> [SEP] ... [SEP] row padded with pad tokens."""
+        ids = [token_id for token_id in row if token_id != self.pad_token_id]
+        return ids[3:-1]
+
+    def score(self, query: str, snippets: List[str], batch_size: int = CROSS_ENCODER_BATCH_SIZE) -> List[float]:
+        """Relevance logits for each snippet, in one forward pass per batch_size snippets."""
+        if not snippets:
+            return []
+        query_ids = self.content_ids(query)
+        pairs = [self.pair_ids(query_ids, self.content_ids(snippet)) for snippet in snippets]
+        was_training = self.training
+        self.eval()
+        try:
+            with torch.inference_mode():
+                return [
+                    float(logit)
+                    for start in range(0, len(pairs), batch_size)
+                    for logit in self.logits(pairs[start : start + batch_size]).cpu()
+                ]
+        finally:
+            self.train(was_training)
+
+    def save(self, path: str):
+        torch.save(self.state_dict(), path)
+
+    @classmethod
+    def load(
+        cls, path: str, model_name: str = MODEL_NAME, device: Optional[torch.device] = None
+    ) -> "CrossEncoder":
+        cross_encoder = cls(UniXcoder(model_name))
+        cross_encoder.load_state_dict(torch.load(path, map_location=device or "cpu"))
+        if device is not None:
+            cross_encoder.to(device)
+        return cross_encoder.eval()
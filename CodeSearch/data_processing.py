@@ -1,6 +1,12 @@
+import os
+import queue
 import sqlite3
-from concurrent.futures import ThreadPoolExecutor
-from typing import Any, List, Optional, Tuple
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, Optional, Set, Tuple
 
 import numpy as np
 import torch
@@ -8,12 +14,15 @@ from datasets import load_dataset
 from torch import cuda, tensor
 from torch import device as DeviceModel
 from tqdm import tqdm
-from unixcoder import UniXcoder
+from unixcoder import UniXcoder, top_k_indices
 
-from models.code_search_net import DataPoint
+from embedding_file import load_embedding_matrix
+from models.code_search_net import IndexRecord
+from storage import DB_FILE, connect, create_schema, insert_code_embeddings, insert_entries
+from tokenizer_worker import init_tokenizer, tokenize_encoder_only
 
-# SQLite database file
-DB_FILE = "embeddings.db"
+MODEL_NAME = "microsoft/unixcoder-base"
+INDEX_SOURCE = "code_search_net/python"
 
 
 def init_model() -> Tuple[UniXcoder, DeviceModel, bool]:
@@ -27,7 +36,7 @@ def init_model() -> Tuple[UniXcoder, DeviceModel, bool]:
     else:
         device = DeviceModel("cpu")
 
-    model = UniXcoder("microsoft/unixcoder-base")
+    model = UniXcoder(MODEL_NAME)
     model.to(device)
 
     return model, device, has_gpu
@@ -36,73 +45,169 @@ def init_model() -> Tuple[UniXcoder, DeviceModel, bool]:
 model, device, HAS_GPU = init_model()
 
 
+def pad_token_ids(tokens_ids: List[List[int]], pad_token_id: int) -> List[List[int]]:
+    """Pads every sequence to the longest one in the batch rather than to max_length."""
+    longest = max(len(ids) for ids in tokens_ids)
+    return [ids + [pad_token_id] * (longest - len(ids)) for ids in tokens_ids]
+
+
 def create_table(cursor: sqlite3.Cursor):
-    """Creates the embeddings table if it doesn't exist."""
+    """Creates the embeddings, code_strings and index_progress tables if they don't exist."""
+    create_schema(cursor)
+    create_progress_table(cursor)
+
+
+def create_progress_table(cursor: sqlite3.Cursor):
+    """Creates the table holding the checkpoint of an interrupted index build."""
     cursor.execute(
-        """CREATE TABLE IF NOT EXISTS embeddings (
-            id INTEGER PRIMARY KEY,
-            code_string TEXT,
-            embedding BLOB
+        """CREATE TABLE IF NOT EXISTS index_progress (
+            source TEXT PRIMARY KEY,
+            next_id INTEGER,
+            updated_at REAL
         )"""
     )
 
 
-def embedding_exists(cursor: sqlite3.Cursor, index: int) -> bool:
-    """Checks if an embedding already exists in the database."""
-    cursor.execute("SELECT 1 FROM embeddings WHERE id = ?", (index,))
-    return cursor.fetchone() is not None
+def save_checkpoint(cursor: sqlite3.Cursor, next_id: int, source: str = INDEX_SOURCE):
+    """Records that every id below next_id is stored. Commit it with the rows it covers."""
+    cursor.execute(
+        "INSERT OR REPLACE INTO index_progress (source, next_id, updated_at) VALUES (?, ?, ?)",
+        (source, next_id, time.time()),
+    )
 
 
-def store_embedding_bulk(
-    entries: List[Tuple[int, str, np.ndarray]], cursor: sqlite3.Cursor
-):
-    cursor.executemany(
-        "INSERT INTO embeddings (id, code_string, embedding) VALUES (?, ?, ?)",
-        [(i, code, emb.tobytes()) for i, code, emb in entries],
-    )
+def load_checkpoint(cursor: sqlite3.Cursor, source: str = INDEX_SOURCE) -> int:
+    """Returns the first id not covered by the last committed chunk (0 if none)."""
+    create_progress_table(cursor)
+    cursor.execute("SELECT next_id FROM index_progress WHERE source = ?", (source,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
 
 
-def store_embedding(
-    index: int, code_string: str, embedding: np.ndarray, cursor: sqlite3.Cursor
-):
-    """Stores an embedding in the SQLite database."""
+def existing_ids(cursor: sqlite3.Cursor, ids: List[int], table: str = "embeddings") -> Set[int]:
+    """Returns which of ids are already stored, in one primary-key range scan."""
+    if not ids:
+        return set()
     cursor.execute(
-        "INSERT INTO embeddings (id, code_string, embedding) VALUES (?, ?, ?)",
-        (index, code_string, embedding.tobytes()),
+        f"SELECT id FROM {table} WHERE id BETWEEN ? AND ?", (min(ids), max(ids))
     )
+    wanted = set(ids)
+    return {row[0] for row in cursor.fetchall() if row[0] in wanted}
+
+
+def filter_new(
+    cursor: sqlite3.Cursor, data_points: List[IndexRecord], table: str = "embeddings"
+) -> List[IndexRecord]:
+    """Drops data points whose embedding is already stored in table."""
+    stored = existing_ids(cursor, [dp.id for dp in data_points], table)
+    return [dp for dp in data_points if dp.id not in stored]
+
+
+def store_embedding_bulk(
+    entries: List[Tuple[int, str, np.ndarray]], cursor: sqlite3.Cursor
+):
+    insert_entries(entries, cursor)
+
+
+def store_code_embedding_bulk(entries: List[Tuple[int, np.ndarray]], cursor: sqlite3.Cursor):
+    insert_code_embeddings(entries, cursor)
+
+
+class PaddingStats:
+    """Counts real vs. padded tokens fed to the model during indexing."""
+
+    def __init__(self, max_length: int = 512):
+        self.max_length = max_length
+        self.real_tokens = 0
+        self.padded_tokens = 0
+        self.sequences = 0
+
+    def add(self, batch_ids: List[List[int]]):
+        longest = max(len(ids) for ids in batch_ids)
+        self.real_tokens += sum(len(ids) for ids in batch_ids)
+        self.padded_tokens += longest * len(batch_ids)
+        self.sequences += len(batch_ids)
+
+    @property
+    def pad_ratio(self) -> float:
+        return 1 - self.real_tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+    @property
+    def fixed_pad_ratio(self) -> float:
+        """Pad ratio the old pad-everything-to-max_length batches would have had."""
+        fixed_tokens = self.sequences * self.max_length
+        return 1 - self.real_tokens / fixed_tokens if fixed_tokens else 0.0
+
+
+def embed_token_ids(
+    tokens_ids: List[List[int]],
+    batch_size: int = 16,
+    padding_stats: Optional[PaddingStats] = None,
+) -> List[np.ndarray]:
+    """Runs length-sorted batches through the model. Returns normalized embeddings in input order."""
+    order = sorted(range(len(tokens_ids)), key=lambda i: len(tokens_ids[i]))
+    embeddings: List[Any] = [None] * len(tokens_ids)
+    for start in range(0, len(order), batch_size):
+        batch = order[start : start + batch_size]
+        batch_ids = pad_token_ids([tokens_ids[i] for i in batch], model.config.pad_token_id)
+        if padding_stats is not None:
+            padding_stats.add([tokens_ids[i] for i in batch])
+        source_ids = tensor(batch_ids).to(device)
+        with torch.no_grad():
+            _, nl_embedding = model(source_ids)
+        normalized = torch.nn.functional.normalize(nl_embedding, p=2, dim=1).cpu().numpy()
+        for i, emb in zip(batch, normalized):
+            embeddings[i] = emb
+    return embeddings
 
 
 def generate_embeddings_ACCELERATED(
-    data_points: List[DataPoint], cursor: sqlite3.Cursor
+    data_points: List[IndexRecord],
+    cursor: sqlite3.Cursor,
+    batch_size: int = 16,
+    padding_stats: Optional[PaddingStats] = None,
 ) -> List[Tuple[int, str, np.ndarray]]:
-    filtered_data_points = list(
-        filter(lambda dp: not embedding_exists(cursor, dp.id), data_points)
-    )
+    """Embeds docstrings in length-sorted batches, each padded only to its own longest member.
+
+    Pass a window of many batches: the wider the window, the tighter the length
+    buckets. Entries come back in the original data point order.
+    """
+    filtered_data_points = filter_new(cursor, data_points)
+    if not filtered_data_points:
+        return []
     tokens_ids = model.tokenize(
         [dp.func_documentation_string for dp in filtered_data_points],
         max_length=512,
         mode="<encoder-only>",
-        padding=True,
     )
-    source_ids = tensor(tokens_ids).to(device)
-    with torch.no_grad():
-        _, nl_embedding = model(source_ids)
-
-    embedding = torch.nn.functional.normalize(nl_embedding, p=2, dim=1)
-    entries = []
-    for i, dp in enumerate(filtered_data_points):
-        emb = torch.flatten(embedding[i]).detach().cpu().numpy()
-        entries.append((dp.id, dp.whole_func_string, emb))
-    return entries
-
+    embeddings = embed_token_ids(tokens_ids, batch_size, padding_stats)
+    return [
+        (dp.id, dp.whole_func_string, embeddings[i])
+        for i, dp in enumerate(filtered_data_points)
+    ]
+
+
+def generate_code_embeddings_ACCELERATED(
+    data_points: List[IndexRecord],
+    cursor: sqlite3.Cursor,
+    batch_size: int = 16,
+    padding_stats: Optional[PaddingStats] = None,
+) -> List[Tuple[int, np.ndarray]]:
+    """Embeds function bodies the same way generate_embeddings_ACCELERATED embeds docstrings."""
+    filtered_data_points = filter_new(cursor, data_points, "code_embeddings")
+    if not filtered_data_points:
+        return []
+    tokens_ids = model.tokenize(
+        [dp.whole_func_string for dp in filtered_data_points],
+        max_length=512,
+        mode="<encoder-only>",
+    )
+    embeddings = embed_token_ids(tokens_ids, batch_size, padding_stats)
+    return [(dp.id, embeddings[i]) for i, dp in enumerate(filtered_data_points)]
 
-def generate_embedding(
-    snippet_for_model: str, code_string: str, index: int, cursor: sqlite3.Cursor
-):
-    """Generates and stores an embedding if it doesn't already exist."""
-    if embedding_exists(cursor, index):
-        return  # Skip processing if already exists
 
+def embed_docstring(snippet_for_model: str) -> np.ndarray:
+    """Embeds a single docstring (or code snippet) and returns the normalized vector."""
     tokens_ids = model.tokenize(
         [snippet_for_model], max_length=512, mode="<encoder-only>"
     )
@@ -116,60 +221,241 @@ def generate_embedding(
         .cpu()
         .numpy()
     )
+    return embedding
+
+
+def process_single_dp(dp: IndexRecord) -> Tuple[int, str, np.ndarray]:
+    return dp.id, dp.whole_func_string, embed_docstring(dp.func_documentation_string)
+
+
+def process_single_code(dp: IndexRecord) -> Tuple[int, np.ndarray]:
+    return dp.id, embed_docstring(dp.whole_func_string)
+
+
+def embedding_writer(entry_queue: "queue.Queue", db_file: str, commit_rows: int, errors: List[BaseException]):
+    """Single SQLite writer: inserts queued (next_id, entries, code_entries) chunks, committing every commit_rows rows.
+
+    Chunks arrive in id order, so each commit also checkpoints the next id to index.
+    A failure rolls back the open transaction, is appended to errors and stops the
+    writer; the producer sees it through put_to_writer.
+    """
+    try:
+        with connect(db_file) as conn:
+            cursor = conn.cursor()
+            pending = 0
+            while True:
+                item = entry_queue.get()
+                if item is None:
+                    break
+                next_id, entries, code_entries = item
+                store_embedding_bulk(entries, cursor)
+                store_code_embedding_bulk(code_entries, cursor)
+                save_checkpoint(cursor, next_id)
+                pending += len(entries) + len(code_entries)
+                if pending >= commit_rows:
+                    conn.commit()
+                    pending = 0
+            conn.commit()
+    except Exception as e:
+        errors.append(e)
+
+
+def put_to_writer(entry_queue: "queue.Queue", item: Any, writer: threading.Thread, poll: float = 1.0) -> bool:
+    """Queue.put that gives up, returning False, once the writer thread has stopped."""
+    while writer.is_alive():
+        try:
+            entry_queue.put(item, timeout=poll)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def iter_chunks(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yields lists of up to size items without materializing the iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def process_data_cpu_pipeline(
+    data_points: Iterable[IndexRecord],
+    cursor: sqlite3.Cursor,
+    total: Optional[int] = None,
+    chunk_size: int = 256,
+    batch_size: int = 16,
+    tokenizer_workers: Optional[int] = None,
+    torch_threads: Optional[int] = None,
+    commit_rows: int = 2048,
+    embed_code: bool = False,
+) -> int:
+    """CPU indexing as a three-stage pipeline. Returns the number of rows consumed.
+
+    A process pool tokenizes chunks of docstrings (and, with embed_code, function
+    bodies), this thread is the only model worker and runs padded, length-sorted
+    batches with a fixed torch thread count, and one writer thread inserts the
+    results in batched transactions.
+    """
+    cpu_count = os.cpu_count() or 1
+    tokenizer_workers = tokenizer_workers or max(1, min(4, cpu_count // 4))
+    torch_threads = torch_threads or max(1, cpu_count - tokenizer_workers)
+    previous_threads = torch.get_num_threads()
+    torch.set_num_threads(torch_threads)
+
+    entry_queue: "queue.Queue" = queue.Queue(maxsize=8)
+    writer_errors: List[BaseException] = []
+    writer = threading.Thread(
+        target=embedding_writer, args=(entry_queue, DB_FILE, commit_rows, writer_errors), daemon=True
+    )
+    writer.start()
 
-    store_embedding(index, code_string, embedding, cursor)
+    padding_stats = PaddingStats()
 
-def process_single_dp(dp):
-    with sqlite3.connect(DB_FILE) as conn:
-        thread_cursor = conn.cursor()
-        generate_embedding(
-            dp.func_documentation_string,
-            dp.whole_func_string,
-            dp.id,
-            thread_cursor,
+    def embed_chunk(todo, code_todo, next_id, future, pbar):
+        # Docstrings and bodies share the length-sorted batches
+        embeddings = embed_token_ids(future.result(), batch_size, padding_stats)
+        item = (
+            next_id,
+            [(dp.id, dp.whole_func_string, emb) for dp, emb in zip(todo, embeddings)],
+            [(dp.id, emb) for dp, emb in zip(code_todo, embeddings[len(todo):])],
         )
-        conn.commit()
-
-def process_data(data_points: List[DataPoint], cursor: sqlite3.Cursor) -> None:
-    """Processes data points in parallel and stores embeddings in SQLite."""
+        if not put_to_writer(entry_queue, item, writer):
+            raise writer_errors[0] if writer_errors else RuntimeError("Embedding writer stopped")
+        pbar.update(len(todo))
+        pbar.set_postfix(pad_ratio=f"{padding_stats.pad_ratio:.1%}")
+
+    rows = 0
+    try:
+        with ProcessPoolExecutor(
+            max_workers=tokenizer_workers,
+            initializer=init_tokenizer,
+            initargs=(MODEL_NAME,),
+        ) as pool, tqdm(
+            total=total, desc="Generating & Storing embeddings (CPU pipeline)"
+        ) as pbar:
+            in_flight = deque()
+            for chunk in iter_chunks(data_points, chunk_size):
+                rows += len(chunk)
+                todo = filter_new(cursor, chunk)
+                code_todo = filter_new(cursor, chunk, "code_embeddings") if embed_code else []
+                pbar.update(len(chunk) - len(todo))
+                if not todo and not code_todo:
+                    continue
+                texts = [dp.func_documentation_string for dp in todo]
+                texts += [dp.whole_func_string for dp in code_todo]
+                in_flight.append((
+                    todo,
+                    code_todo,
+                    chunk[-1].id + 1,
+                    pool.submit(tokenize_encoder_only, texts, 512),
+                ))
+                # Keep the tokenizers a couple of chunks ahead of the model
+                if len(in_flight) > 2 * tokenizer_workers:
+                    embed_chunk(*in_flight.popleft(), pbar)
+            while in_flight:
+                embed_chunk(*in_flight.popleft(), pbar)
+    finally:
+        put_to_writer(entry_queue, None, writer)
+        writer.join()
+        torch.set_num_threads(previous_threads)
+    if writer_errors:
+        # e.g. the final commit failed after every chunk was queued
+        raise writer_errors[0]
+    print(
+        f"Pad ratio {padding_stats.pad_ratio:.1%} "
+        f"(fixed max_length padding would be {padding_stats.fixed_pad_ratio:.1%})"
+    )
+    return rows
+
+
+def process_data(
+    data_points: Iterable[IndexRecord],
+    cursor: sqlite3.Cursor,
+    cpu_mode: str = "pipeline",
+    total: Optional[int] = None,
+    commit_batches: int = 64,
+    embed_code: bool = False,
+) -> None:
+    """Processes data points in parallel and stores embeddings in SQLite.
+
+    data_points may be a lazy iterator in id order; it is consumed in chunks and
+    committed every commit_batches batches together with an index_progress
+    checkpoint, so memory stays flat and an interrupted build can resume. On CPU,
+    cpu_mode picks the batched multi-process pipeline or the older per-row thread
+    pool ("threads"). Rows/sec is printed either way.
+
+    With embed_code, each function body is embedded too (into code_embeddings),
+    including for rows whose docstring embedding already exists.
+    """
+    if total is None and hasattr(data_points, "__len__"):
+        total = len(data_points)  # type: ignore[arg-type]
+    started = time.perf_counter()
+    rows = 0
     if HAS_GPU:
         batch_size = 16
-        with tqdm(
-            total=len(data_points), desc="Generating & Storing embeddings (GPU)"
-        ) as pbar:
-            entries: List[Tuple[int, str, np.ndarray]] = []
-            for i in range(0, len(data_points), batch_size):
-                batch = data_points[i : i + batch_size]
-                entries.extend(generate_embeddings_ACCELERATED(batch, cursor))
-                pbar.update(len(batch))
-            store_embedding_bulk(entries, cursor)
-    else:
-        with ThreadPoolExecutor() as executor:
-            list(
-                tqdm(
-                    executor.map(
-                        process_single_dp,
-                        data_points,
-                    ),
-                    total=len(data_points),
-                    desc="Generating & Storing embeddings (CPU)",
+        # Length buckets are formed within, and commits happen after, each window
+        window_size = batch_size * commit_batches
+        padding_stats = PaddingStats()
+        with tqdm(total=total, desc="Generating & Storing embeddings (GPU)") as pbar:
+            for window in iter_chunks(data_points, window_size):
+                store_embedding_bulk(
+                    generate_embeddings_ACCELERATED(window, cursor, batch_size, padding_stats),
+                    cursor,
                 )
-            )
+                if embed_code:
+                    store_code_embedding_bulk(
+                        generate_code_embeddings_ACCELERATED(
+                            window, cursor, batch_size, padding_stats
+                        ),
+                        cursor,
+                    )
+                save_checkpoint(cursor, window[-1].id + 1)
+                cursor.connection.commit()
+                rows += len(window)
+                pbar.update(len(window))
+                pbar.set_postfix(pad_ratio=f"{padding_stats.pad_ratio:.1%}")
+        print(
+            f"Pad ratio {padding_stats.pad_ratio:.1%} "
+            f"(fixed max_length padding would be {padding_stats.fixed_pad_ratio:.1%})"
+        )
+    elif cpu_mode == "pipeline":
+        rows = process_data_cpu_pipeline(
+            data_points,
+            cursor,
+            total=total,
+            commit_rows=16 * commit_batches,
+            embed_code=embed_code,
+        )
+    else:
+        # executor.map submits everything up front, so feed it bounded chunks
+        with ThreadPoolExecutor() as executor, tqdm(
+            total=total, desc="Generating & Storing embeddings (CPU)"
+        ) as pbar:
+            for chunk in iter_chunks(data_points, 256):
+                rows += len(chunk)
+                todo = filter_new(cursor, chunk)
+                pbar.update(len(chunk) - len(todo))
+                # Rows are embedded by the pool and written here in one transaction per chunk
+                store_embedding_bulk(list(executor.map(process_single_dp, todo)), cursor)
+                if embed_code:
+                    code_todo = filter_new(cursor, chunk, "code_embeddings")
+                    store_code_embedding_bulk(
+                        list(executor.map(process_single_code, code_todo)), cursor
+                    )
+                pbar.update(len(todo))
+                save_checkpoint(cursor, chunk[-1].id + 1)
+                cursor.connection.commit()
+    elapsed = time.perf_counter() - started
+    rows_per_sec = rows / max(elapsed, 1e-9)
+    print(f"Indexed {rows} rows in {elapsed:.1f}s ({rows_per_sec:.1f} rows/sec)")
 
 
 def load_embeddings():
-    """Loads all embeddings from SQLite into memory for fast search."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, embedding FROM embeddings")
-        rows = cursor.fetchall()
-
-    ids, embeddings = [], []
-    for idx, blob in rows:
-        ids.append(idx)
-        embeddings.append(np.frombuffer(blob, dtype=np.float32))
-
-    return np.array(ids), np.stack(embeddings)
+    """Loads all embeddings into memory for fast search."""
+    return load_embedding_matrix(DB_FILE)
 
 
 def search(query_embedding: np.ndarray, top_k: int = 10):
@@ -180,45 +466,50 @@ def search(query_embedding: np.ndarray, top_k: int = 10):
     scores = np.dot(embeddings_matrix, query_embedding)
 
     # Get top K results
-    top_indices = np.argsort(scores)[::-1][:top_k]
+    top_indices = top_k_indices(scores, top_k)
 
     return [(ids[i], scores[i]) for i in top_indices]
 
 
-def create_code_search_net_dataset(slice_size: Optional[int] = None) -> List[DataPoint]:
-    """Loads a subset of the CodeSearchNet dataset and returns it as DataPoint objects."""
-    dataset: Any = load_dataset(
-        "code_search_net",
-        "python",
-        split="train+test+validation",
-        trust_remote_code=True,
-    )
-    if slice_size:
-        dataset = dataset.select(range(slice_size))
-
-    data_points: List[DataPoint] = []
-    for idx, item in tqdm(
-        enumerate(dataset), total=len(dataset), desc="Loading dataset"
-    ):
-        try:
-            data_point = DataPoint(
-                id=idx,
-                repository_name=item.get("repository_name", ""),
-                func_path_in_repository=item.get("func_path_in_repository", ""),
-                func_name=item.get("func_name", ""),
-                whole_func_string=item.get("whole_func_string", ""),
-                language=item.get("language", ""),
-                func_code_string=item.get("func_code_string", ""),
-                func_code_tokens=item.get("func_code_tokens", []),
-                func_documentation_string=item.get("func_documentation_string", ""),
-                func_documentation_string_tokens=item.get(
-                    "func_documentation_string_tokens", []
-                ),
-                split_name="test",
-                func_code_url=item.get("func_code_url", ""),
-            )
-            data_points.append(data_point)
-        except Exception as e:
-            print(f"Error processing item {idx}: {e}")
-
-    return data_points
+CODE_SEARCH_NET_SPLITS = ("train", "test", "validation")
+INDEX_COLUMNS = ["func_documentation_string", "whole_func_string"]
+
+
+def iter_code_search_net(
+    slice_size: Optional[int] = None,
+    streaming: bool = False,
+    batch_size: int = 1000,
+    start_id: int = 0,
+) -> Iterator[IndexRecord]:
+    """Yields CodeSearchNet python functions lazily, keeping only the columns indexing needs.
+
+    Without streaming the splits are read in arrow batches from the memory-mapped
+    dataset cache; with streaming nothing is downloaded up front. Ids are positions
+    in train+test+validation, as in the split="train+test+validation" dataset. Records
+    below start_id are skipped, which is how a build resumes from its checkpoint.
+    """
+    idx = 0
+    for split in CODE_SEARCH_NET_SPLITS:
+        if slice_size is not None and idx >= slice_size:
+            return
+        dataset: Any = load_dataset(
+            "code_search_net",
+            "python",
+            split=split,
+            streaming=streaming,
+            trust_remote_code=True,
+        ).select_columns(INDEX_COLUMNS)
+        if not streaming and start_id > idx:
+            # Map-style splits know their length, so jump straight to start_id
+            skip = min(start_id - idx, len(dataset))
+            dataset = dataset.select(range(skip, len(dataset)))
+            idx += skip
+        for batch in dataset.iter(batch_size=batch_size):
+            for doc, code in zip(batch["func_documentation_string"], batch["whole_func_string"]):
+                if slice_size is not None and idx >= slice_size:
+                    return
+                if idx >= start_id:
+                    yield IndexRecord(
+                        id=idx, func_documentation_string=doc or "", whole_func_string=code or ""
+                    )
+                idx += 1
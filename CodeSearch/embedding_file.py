@@ -0,0 +1,151 @@
+# Fixed-stride embedding matrix on disk that every worker process can np.memmap.
+#
+# embeddings.npy holds one float32 row per function and embeddings_ids.npy maps
+# row -> embeddings.id. Opening them is zero-copy: pages come from the OS page cache
+# and are shared by every process that maps the same file.
+
+import os
+import sqlite3
+import time
+from typing import Tuple
+
+import numpy as np
+
+from storage import connect
+
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDING_IDS_FILE = "embeddings_ids.npy"
+
+EXPORT_CHUNK_ROWS = 4096
+# An export renames the matrix and then the ids; a reader caught in between retries
+OPEN_RETRIES = 5
+OPEN_RETRY_DELAY = 0.1
+
+
+def mmap_exists(matrix_file: str = EMBEDDINGS_FILE, ids_file: str = EMBEDDING_IDS_FILE) -> bool:
+    return os.path.exists(matrix_file) and os.path.exists(ids_file)
+
+
+def open_embeddings(
+    matrix_file: str = EMBEDDINGS_FILE, ids_file: str = EMBEDDING_IDS_FILE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Memory-maps the exported matrix read-only. Returns (ids, matrix).
+
+    A row/id count mismatch means an export is between its two renames, so the pair
+    is reopened until the counts agree (an export only ever appends rows).
+    """
+    for attempt in range(OPEN_RETRIES):
+        ids = np.load(ids_file, mmap_mode="r")
+        matrix = np.load(matrix_file, mmap_mode="r")
+        if matrix.shape[0] == ids.shape[0]:
+            return ids, matrix
+        time.sleep(OPEN_RETRY_DELAY)
+    raise ValueError(
+        f"{matrix_file} has {matrix.shape[0]} rows but {ids_file} has {ids.shape[0]} ids"
+    )
+
+
+def blobs_to_matrix(blobs) -> np.ndarray:
+    """Decodes a sequence of float32 BLOBs in one frombuffer call instead of one per row."""
+    blobs = list(blobs)
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(len(blobs), -1)
+
+
+def export_embeddings(
+    cursor: sqlite3.Cursor,
+    matrix_file: str = EMBEDDINGS_FILE,
+    ids_file: str = EMBEDDING_IDS_FILE,
+    drop_blobs: bool = False,
+) -> int:
+    """Writes every stored vector to the memmap files and returns the row count.
+
+    Rows already in an earlier export are carried over, so the export can be re-run
+    after each indexing pass. With drop_blobs the exported BLOBs are cleared and
+    SQLite only keeps the code_string text. Each new file replaces its old one
+    atomically, the matrix first and then the ids, so between the two renames the
+    pair disagrees; open_embeddings waits that out. Processes that still map the old
+    files keep a valid view.
+    """
+    if mmap_exists(matrix_file, ids_file):
+        old_ids, old_matrix = open_embeddings(matrix_file, ids_file)
+    else:
+        old_ids, old_matrix = np.empty(0, dtype=np.int64), None
+
+    cursor.execute("SELECT id FROM embeddings WHERE embedding IS NOT NULL ORDER BY id")
+    db_ids = np.fromiter((row[0] for row in cursor), dtype=np.int64)
+    new_ids = np.setdiff1d(db_ids, old_ids, assume_unique=True)
+
+    if old_matrix is not None:
+        dim = old_matrix.shape[1]
+    elif len(new_ids):
+        cursor.execute("SELECT embedding FROM embeddings WHERE id = ?", (int(new_ids[0]),))
+        dim = len(cursor.fetchone()[0]) // np.dtype(np.float32).itemsize
+    else:
+        print("No embeddings to export.")
+        return 0
+
+    total = len(old_ids) + len(new_ids)
+    tmp_matrix_file, tmp_ids_file = matrix_file + ".tmp", ids_file + ".tmp"
+    matrix = np.lib.format.open_memmap(
+        tmp_matrix_file, mode="w+", dtype=np.float32, shape=(total, dim)
+    )
+    for start in range(0, len(old_ids), EXPORT_CHUNK_ROWS):
+        end = min(start + EXPORT_CHUNK_ROWS, len(old_ids))
+        matrix[start:end] = old_matrix[start:end]
+
+    row = len(old_ids)
+    cursor.execute("SELECT id, embedding FROM embeddings WHERE embedding IS NOT NULL ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+        if not rows:
+            break
+        chunk_ids = np.fromiter((idx for idx, _ in rows), dtype=np.int64, count=len(rows))
+        keep = np.isin(chunk_ids, new_ids, assume_unique=True)
+        if not keep.any():
+            continue
+        vectors = blobs_to_matrix(blob for (_, blob), k in zip(rows, keep) if k)
+        matrix[row : row + len(vectors)] = vectors
+        row += len(vectors)
+    matrix.flush()
+    del matrix
+
+    with open(tmp_ids_file, "wb") as f:
+        np.save(f, np.concatenate([old_ids, new_ids]).astype(np.int64))
+    os.replace(tmp_matrix_file, matrix_file)
+    os.replace(tmp_ids_file, ids_file)
+
+    if drop_blobs:
+        cursor.execute("UPDATE embeddings SET embedding = NULL WHERE embedding IS NOT NULL")
+
+    print(f"Exported {total} embeddings ({len(new_ids)} new) to {matrix_file}")
+    return total
+
+
+def load_embedding_matrix(db_file: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (ids, matrix) for every stored vector.
+
+    Uses the exported memmap file when present and only reads rows newer than the
+    export from SQLite.
+    """
+    base_ids, base = np.empty(0, dtype=np.int64), None
+    if mmap_exists():
+        base_ids, base = open_embeddings()
+    floor = int(base_ids.max()) if len(base_ids) else -1
+
+    with connect(db_file) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, embedding FROM embeddings WHERE id > ? AND embedding IS NOT NULL",
+            (floor,),
+        )
+        rows = cursor.fetchall()
+
+    ids = np.array([idx for idx, _ in rows], dtype=np.int64)
+    embeddings = blobs_to_matrix(blob for _, blob in rows)
+    if base is None:
+        return ids, embeddings
+    if not rows:
+        return np.asarray(base_ids), base
+    return np.concatenate([base_ids, ids]), np.concatenate([base, embeddings])
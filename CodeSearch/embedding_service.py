@@ -0,0 +1,104 @@
+# Dynamic micro-batching of query embeddings.
+#
+# Concurrent requests each submit their token ids; a single worker thread waits a few
+# milliseconds (or until max_batch_size queries are queued), pads the batch to its
+# longest member and runs one forward pass for all of them.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+import numpy as np
+import torch
+
+from data_processing import pad_token_ids
+
+
+class EmbeddingBatcher:
+    """Single model worker that answers queued encode requests in padded micro-batches."""
+
+    def __init__(self, model, device, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Tuple[List[int], float, Future]]" = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._queries = 0
+        self._batch_sizes: Dict[int, int] = {}
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._total_forward = 0.0
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, token_ids: List[int]) -> Future:
+        future: Future = Future()
+        self._queue.put((token_ids, time.perf_counter(), future))
+        return future
+
+    def encode(self, token_ids: List[int]) -> np.ndarray:
+        """Blocks until the batch holding this query has run. Returns a normalized embedding."""
+        return self.submit(token_ids).result()
+
+    def _collect(self) -> List[Tuple[List[int], float, Future]]:
+        batch = [self._queue.get()]
+        deadline = batch[0][1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                source_ids = torch.tensor(
+                    pad_token_ids([token_ids for token_ids, _, _ in batch], self.model.config.pad_token_id)
+                ).to(self.device)
+                with torch.inference_mode():
+                    _, nl_embedding = self.model(source_ids)
+                embeddings = torch.nn.functional.normalize(nl_embedding, p=2, dim=1).cpu().numpy()
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            finished = time.perf_counter()
+            for (_, _, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+            self._record(batch, started, finished)
+
+    def _record(self, batch, started: float, finished: float):
+        waits = [started - enqueued for _, enqueued, _ in batch]
+        with self._metrics_lock:
+            self._batches += 1
+            self._queries += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+            self._total_forward += finished - started
+
+    def metrics(self) -> Dict[str, object]:
+        with self._metrics_lock:
+            batches = max(self._batches, 1)
+            queries = max(self._queries, 1)
+            return {
+                "batches": self._batches,
+                "queries": self._queries,
+                "mean_batch_size": self._queries / batches,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "mean_wait_ms": 1000 * self._total_wait / queries,
+                "max_wait_ms": 1000 * self._max_wait_seen,
+                "mean_forward_ms": 1000 * self._total_forward / batches,
+                "queue_depth": self._queue.qsize(),
+            }
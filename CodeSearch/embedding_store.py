@@ -0,0 +1,388 @@
+# Keeps the embeddings table resident in memory so a query is one matrix-vector product.
+
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from unixcoder import top_k_indices
+
+from ann_index import IVFIndex
+from embedding_file import (
+    EMBEDDING_IDS_FILE,
+    EMBEDDINGS_FILE,
+    EXPORT_CHUNK_ROWS,
+    blobs_to_matrix,
+    mmap_exists,
+    open_embeddings,
+)
+from pq_index import PQIndex
+from quantization import ScalarQuantizer, open_quantized
+from storage import DB_FILE, connect, create_schema, fetch_code_strings
+
+# With rescoring, this many times top_k quantized candidates are re-ranked in float32
+RESCORE_FACTOR = 4
+
+
+class EmbeddingStore:
+    """Process-wide float32 embedding matrix mirrored from the SQLite embeddings table.
+
+    Rows are loaded once and then pulled in incrementally: `refresh` is a no-op
+    unless another connection has committed to the database since the last call.
+    When an exported memmap file exists it is used as the read-only base and only
+    rows with a higher id than the export are held in process memory.
+
+    With a quantizer the scanned matrix holds float16/int8 codes instead of float32
+    (the quantized export is mapped when present). With rescore, the top candidates
+    of a quantized scan or of an approximate (PQ) index are re-ranked with their
+    float32 vectors.
+
+    With code_weight > 0 each row also holds its code_embeddings vector (or the
+    docstring vector again when the body wasn't embedded), stacked as [doc | code],
+    and one scan against [(1 - w) * q | w * q] scores
+    (1 - w) * doc_similarity + w * code_similarity. Hybrid rows are always float32,
+    so the quantizer and ANN index are not used. Exported rows keep their docstring
+    vectors in the memmap base; the code vectors of those rows are read once here.
+    """
+
+    def __init__(
+        self,
+        db_file: str = DB_FILE,
+        initial_capacity: int = 1024,
+        matrix_file: str = EMBEDDINGS_FILE,
+        ids_file: str = EMBEDDING_IDS_FILE,
+        quantizer: Optional[ScalarQuantizer] = None,
+        rescore: bool = True,
+        code_weight: float = 0.0,
+    ):
+        if code_weight > 0 and quantizer is not None:
+            raise ValueError("Hybrid doc/code scoring needs float32 vectors; drop the quantizer")
+        self.db_file = db_file
+        self.quantizer = quantizer
+        self.rescore = rescore
+        self.code_weight = code_weight
+        self.hybrid = code_weight > 0
+        self._dtype = np.dtype(quantizer.dtype if quantizer else np.float32)
+        self._base_ids = np.empty(0, dtype=np.int64)
+        self._base_vectors = np.empty((0, 0), dtype=np.float32)
+        if mmap_exists(matrix_file, ids_file):
+            self._base_ids, self._base_vectors = open_embeddings(matrix_file, ids_file)
+        self._base = self._base_vectors
+        if quantizer is not None and len(self._base_ids):
+            self._base = open_quantized(quantizer.dtype, len(self._base_ids), matrix_file)
+            if self._base is None:
+                self._base = self._encode_base()
+        self._floor = int(self._base_ids.max()) if len(self._base_ids) else -1
+        self._conn = connect(db_file, check_same_thread=False)
+        create_schema(self._conn.cursor())
+        # Hybrid: base rows (positions into the memmap) that have a code vector, and those vectors
+        self._base_code_rows = np.empty(0, dtype=np.int64)
+        self._base_code_vectors = np.empty((0, 0), dtype=np.float32)
+        if self.hybrid and len(self._base_ids):
+            self._load_base_code_vectors()
+        self._lock = threading.Lock()
+        # Per-thread connections for point lookups, so they don't hold the store lock
+        self._readers = threading.local()
+        self._data_version = None
+        self._initial_capacity = initial_capacity
+        self._size = 0
+        self._code_size = 0  # hybrid rows with a real code vector
+        self._ids = np.empty(0, dtype=np.int64)
+        self._buffer = None  # allocated once the embedding width is known
+        self._index: Optional[Union[IVFIndex, PQIndex]] = None
+
+    def _read_cursor(self) -> sqlite3.Cursor:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = connect(self.db_file)
+        return conn.cursor()
+
+    @property
+    def exact_scores(self) -> bool:
+        """Whether search() scores are already float32 docstring similarities, so an
+        exact re-score of its candidates would only recompute them."""
+        if self.hybrid:
+            return False
+        if self.rescore:
+            return True
+        if self._index is not None:
+            return self._index.exact_scores
+        return self.quantizer is None
+
+    def __len__(self) -> int:
+        return len(self._base_ids) + self._size
+
+    # ids/matrix cover the in-memory rows loaded from SQLite, not the memmap base
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[: self._size]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Docstring rows held in memory, as codes when a quantizer is set."""
+        if self._buffer is None:
+            return np.empty((0, 0), dtype=self._dtype)
+        if self.hybrid:
+            return self._buffer[: self._size, : self._buffer.shape[1] // 2]
+        return self._buffer[: self._size]
+
+    @property
+    def _select_rows_sql(self) -> str:
+        if self.hybrid:
+            return (
+                "SELECT e.id, e.embedding, c.embedding FROM embeddings e "
+                "LEFT JOIN code_embeddings c ON c.id = e.id "
+                "WHERE e.id > ? AND e.embedding IS NOT NULL ORDER BY e.id"
+            )
+        return (
+            "SELECT id, embedding FROM embeddings "
+            "WHERE id > ? AND embedding IS NOT NULL ORDER BY id"
+        )
+
+    def _load_base_code_vectors(self):
+        cursor = self._conn.cursor()
+        cursor.execute("SELECT id, embedding FROM code_embeddings WHERE id <= ? ORDER BY id", (self._floor,))
+        rows = cursor.fetchall()
+        order = np.argsort(self._base_ids)
+        code_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        positions = np.searchsorted(self._base_ids, code_ids, sorter=order).clip(max=len(order) - 1)
+        in_base = self._base_ids[order[positions]] == code_ids
+        if in_base.any():
+            self._base_code_rows = order[positions[in_base]]
+            self._base_code_vectors = blobs_to_matrix(row[1] for row, keep in zip(rows, in_base) if keep)
+
+    def _encode_base(self) -> np.ndarray:
+        codes = np.empty(self._base_vectors.shape, dtype=self._dtype)
+        for start in range(0, len(codes), EXPORT_CHUNK_ROWS):
+            codes[start : start + EXPORT_CHUNK_ROWS] = self.quantizer.encode(
+                self._base_vectors[start : start + EXPORT_CHUNK_ROWS]
+            )
+        return codes
+
+    def _reserve(self, extra: int, dim: int):
+        """Grows the backing buffers geometrically so appends stay amortized O(1)."""
+        needed = self._size + extra
+        if self._buffer is not None and needed <= len(self._buffer):
+            return
+        capacity = self._initial_capacity if self._buffer is None else len(self._buffer)
+        while capacity < needed:
+            capacity *= 2
+        buffer = np.empty((capacity, dim), dtype=self._dtype)
+        ids = np.empty(capacity, dtype=np.int64)
+        if self._buffer is not None:
+            buffer[: self._size] = self._buffer[: self._size]
+            ids[: self._size] = self._ids[: self._size]
+        self._buffer, self._ids = buffer, ids
+
+    def _append(self, rows: List[Tuple]):
+        if not rows:
+            return
+        new_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        vectors = blobs_to_matrix(row[1] for row in rows)
+        if self.quantizer is not None:
+            vectors = self.quantizer.encode(vectors)
+        if self.hybrid:
+            code_vectors = vectors.copy()
+            with_code = [i for i, row in enumerate(rows) if row[2] is not None]
+            if with_code:
+                code_vectors[with_code] = blobs_to_matrix(rows[i][2] for i in with_code)
+            vectors = np.hstack([vectors, code_vectors])
+            self._code_size += len(with_code)
+        self._reserve(len(rows), vectors.shape[1])
+        self._buffer[self._size : self._size + len(rows)] = vectors
+        self._ids[self._size : self._size + len(rows)] = new_ids
+        self._size += len(rows)
+
+    def _stored_count(self, cursor: sqlite3.Cursor) -> int:
+        cursor.execute(
+            "SELECT COUNT(*) FROM embeddings WHERE id > ? AND embedding IS NOT NULL",
+            (self._floor,),
+        )
+        return cursor.fetchone()[0]
+
+    def _stored_code_count(self, cursor: sqlite3.Cursor) -> int:
+        cursor.execute(
+            "SELECT COUNT(*) FROM code_embeddings c JOIN embeddings e ON e.id = c.id "
+            "WHERE c.id > ? AND e.embedding IS NOT NULL",
+            (self._floor,),
+        )
+        return cursor.fetchone()[0]
+
+    def refresh(self) -> int:
+        """Loads rows committed since the last refresh. Returns the number of rows added."""
+        with self._lock:
+            cursor = self._conn.cursor()
+            data_version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return 0
+
+            try:
+                high_water = int(self.ids.max()) if self._size else self._floor
+                cursor.execute(self._select_rows_sql, (high_water,))
+                before = self._size
+                previous_ids = self.ids
+                reloaded = False
+                self._append(cursor.fetchall())
+
+                # Rows inserted below the high-water mark (the CPU indexer writes out of
+                # order), code vectors added to existing rows, or deleted rows leave the
+                # counts out of sync: reload everything.
+                if self._stored_count(cursor) != self._size or (
+                    self.hybrid and self._stored_code_count(cursor) != self._code_size
+                ):
+                    # Start from fresh buffers so concurrent searches keep their snapshot.
+                    self._size, self._code_size, self._buffer = 0, 0, None
+                    cursor.execute(self._select_rows_sql, (self._floor,))
+                    self._append(cursor.fetchall())
+                    reloaded = True
+            except sqlite3.Error as e:
+                print(f"SQLite error: {e}")
+                return 0
+
+            self._data_version = data_version
+            if not reloaded:
+                self._index_new_rows(self.ids[before:], self.matrix[before:])
+                return self._size - before
+            # Rows may have been deleted too: prune the index before adding what it lacks
+            if self._index is not None:
+                self._index.retain(np.concatenate([self._base_ids, self.ids]))
+            self._index_new_rows(self.ids, self.matrix)
+            return int(np.count_nonzero(~np.isin(self.ids, previous_ids)))
+
+    def _index_new_rows(self, ids: np.ndarray, vectors: np.ndarray):
+        if self._index is None or len(ids) == 0:
+            return
+        missing = ~self._index.contains(ids)
+        vectors = vectors[missing]
+        if self.quantizer is not None and vectors.dtype != np.float32:
+            vectors = self.quantizer.decode(vectors)
+        self._index.add(ids[missing], vectors)
+
+    def attach_index(self, index: Union[IVFIndex, PQIndex]):
+        """Routes searches through an ANN index, adding any rows it was built without."""
+        if self.quantizer is not None and index.exact_scores:
+            # Its float32 lists would replace the quantized scan, and rows decoded from
+            # the codes would be scored as if exact
+            raise ValueError("A quantized store can't use an exact-score (IVF) index; use PQ or drop the quantizer")
+        with self._lock:
+            self._index = index
+            for ids, vectors in ((self._base_ids, self._base_vectors), (self.ids, self.matrix)):
+                self._index_new_rows(ids, vectors)
+
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 10,
+        n_probe: Optional[int] = None,
+        code_weight: Optional[float] = None,
+    ) -> List[Tuple[int, float]]:
+        """Returns (id, score) pairs for the top_k rows by dot-product similarity.
+
+        Goes through the attached ANN index when there is one; n_probe overrides the
+        IVF index's default number of probed lists. In hybrid mode code_weight
+        overrides the store's doc/code fusion weight for this query.
+        """
+        if self.hybrid:
+            return self._search_hybrid(
+                query_embedding, top_k, self.code_weight if code_weight is None else code_weight
+            )
+        if self._index is not None:
+            if self._index.exact_scores or not self.rescore:
+                return self._index.search(query_embedding, top_k, n_probe=n_probe)
+            candidates = self._index.search(query_embedding, top_k * RESCORE_FACTOR, n_probe=n_probe)
+            return self.exact_rescore(
+                np.asarray(query_embedding, dtype=np.float32), [idx for idx, _ in candidates]
+            )[:top_k]
+        with self._lock:
+            matrix, ids = self.matrix, self.ids
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        rescoring = self.quantizer is not None and self.rescore
+        n_candidates = top_k * RESCORE_FACTOR if rescoring else top_k
+
+        candidates = []
+        for part_ids, part in ((self._base_ids, self._base), (ids, matrix)):
+            if len(part_ids) == 0:
+                continue
+            if self.quantizer is not None:
+                scores = self.quantizer.scores(part, query_embedding)
+            else:
+                scores = part @ query_embedding
+            top_indices = top_k_indices(scores, n_candidates)
+            candidates.extend((int(part_ids[i]), float(scores[i])) for i in top_indices)
+
+        candidates.sort(key=lambda x: x[1], reverse=True)
+        candidates = candidates[:n_candidates]
+        if rescoring and candidates:
+            candidates = self.exact_rescore(query_embedding, [idx for idx, _ in candidates])
+        return candidates[:top_k]
+
+    def _search_hybrid(
+        self, query_embedding: np.ndarray, top_k: int, code_weight: float
+    ) -> List[Tuple[int, float]]:
+        with self._lock:
+            stacked = self._buffer[: self._size] if self._buffer is not None else None
+            ids = self.ids
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        candidates = []
+        if len(self._base_ids):
+            # Base rows without a code vector score as doc-only, like the stacked rows
+            scores = self._base_vectors @ query_embedding
+            if len(self._base_code_rows):
+                code_scores = self._base_code_vectors @ query_embedding
+                scores[self._base_code_rows] = (
+                    (1 - code_weight) * scores[self._base_code_rows] + code_weight * code_scores
+                )
+            candidates.extend(
+                (int(self._base_ids[i]), float(scores[i])) for i in top_k_indices(scores, top_k)
+            )
+        if stacked is not None and len(stacked):
+            fused_query = np.concatenate([(1 - code_weight) * query_embedding, code_weight * query_embedding])
+            scores = stacked @ fused_query
+            candidates.extend((int(ids[i]), float(scores[i])) for i in top_k_indices(scores, top_k))
+        candidates.sort(key=lambda x: x[1], reverse=True)
+        return candidates[:top_k]
+
+    def _float32_vectors(self, ids: List[int]) -> Dict[int, np.ndarray]:
+        """Full-precision vectors for ids, from SQLite or else the float32 export."""
+        placeholders = ",".join("?" * len(ids))
+        cursor = self._read_cursor()
+        cursor.execute(
+            f"SELECT id, embedding FROM embeddings "
+            f"WHERE id IN ({placeholders}) AND embedding IS NOT NULL",
+            ids,
+        )
+        vectors = {idx: np.frombuffer(blob, dtype=np.float32) for idx, blob in cursor}
+        missing = [idx for idx in ids if idx not in vectors]
+        if missing and len(self._base_ids):
+            for row in np.flatnonzero(np.isin(self._base_ids, missing)):
+                vectors[int(self._base_ids[row])] = np.asarray(self._base_vectors[row])
+        return vectors
+
+    def exact_rescore(self, query_embedding: np.ndarray, ids: List[int]) -> List[Tuple[int, float]]:
+        """Re-ranks ids by their float32 docstring similarity, best first."""
+        if not ids:
+            return []
+        vectors = self._float32_vectors(ids)
+        rescored = [(idx, float(vectors[idx] @ query_embedding)) for idx in ids if idx in vectors]
+        rescored.sort(key=lambda x: x[1], reverse=True)
+        return rescored
+
+    def code_scores(self, query_embedding: np.ndarray, ids: List[int]) -> Dict[int, float]:
+        """Similarity to each id's code_embeddings vector; ids without one are left out."""
+        if not ids:
+            return {}
+        placeholders = ",".join("?" * len(ids))
+        cursor = self._read_cursor()
+        cursor.execute(
+            f"SELECT id, embedding FROM code_embeddings WHERE id IN ({placeholders})",
+            [int(i) for i in ids],
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return {}
+        scores = blobs_to_matrix(blob for _, blob in rows) @ np.asarray(query_embedding, dtype=np.float32)
+        return {idx: float(score) for (idx, _), score in zip(rows, scores)}
+
+    def get_code_strings(self, ids: List[int]) -> Dict[int, str]:
+        """Fetches code_string text for the given ids only."""
+        return fetch_code_strings(self._read_cursor(), ids)
@@ -0,0 +1,126 @@
+# BM25 lexical index over code identifiers, kept in an SQLite FTS5 table next to the vectors.
+#
+# Dense retrieval misses exact identifier matches (function names, API calls), so code
+# is indexed as identifier tokens: each identifier is kept whole and also split on
+# snake_case and camelCase boundaries, which lets "parse json" match parseJSON. The
+# FTS5 table is contentless; the text stays in code_strings.
+
+import keyword
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from storage import DB_FILE, connect
+
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+SUBTOKEN_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+
+# Present in nearly every function, so they only cost index space
+STOP_TOKENS = frozenset(keyword.kwlist) | {"self", "cls"}
+
+BUILD_CHUNK_ROWS = 4096
+RRF_K = 60
+
+
+def tokenize_code(text: str) -> List[str]:
+    """Lowercased identifiers plus their snake_case/camelCase parts, minus Python keywords."""
+    tokens = []
+    for identifier in IDENTIFIER_RE.findall(text):
+        if identifier in STOP_TOKENS:
+            continue
+        tokens.append(identifier.lower())
+        parts = SUBTOKEN_RE.findall(identifier)
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+def match_expression(query: str) -> Optional[str]:
+    """FTS5 MATCH string that ORs the query's tokens; None when there are none."""
+    tokens = dict.fromkeys(tokenize_code(query))
+    if not tokens:
+        return None
+    return " OR ".join(f'"{token}"' for token in tokens)
+
+
+def create_lexical_table(cursor: sqlite3.Cursor):
+    cursor.execute(
+        """CREATE VIRTUAL TABLE IF NOT EXISTS code_fts USING fts5(
+            tokens, content='', tokenize="unicode61 tokenchars '_'"
+        )"""
+    )
+
+
+def build_lexical_index(cursor: sqlite3.Cursor) -> int:
+    """Indexes code_strings rows newer than the last indexed id. Returns the rows added."""
+    create_lexical_table(cursor)
+    high_water = cursor.execute("SELECT MAX(rowid) FROM code_fts").fetchone()[0]
+    high_water = -1 if high_water is None else high_water
+    read_cursor = cursor.connection.cursor()
+    read_cursor.execute(
+        "SELECT id, code_string FROM code_strings WHERE id > ? ORDER BY id", (high_water,)
+    )
+    added = 0
+    while True:
+        rows = read_cursor.fetchmany(BUILD_CHUNK_ROWS)
+        if not rows:
+            break
+        cursor.executemany(
+            "INSERT INTO code_fts (rowid, tokens) VALUES (?, ?)",
+            [(idx, " ".join(tokenize_code(code or ""))) for idx, code in rows],
+        )
+        added += len(rows)
+    return added
+
+
+class LexicalIndex:
+    """Read-side BM25 search over the code_fts table."""
+
+    def __init__(self, db_file: str = DB_FILE):
+        self.db_file = db_file
+        self._readers = threading.local()
+        conn = connect(db_file)
+        try:
+            create_lexical_table(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _read_cursor(self) -> sqlite3.Cursor:
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = connect(self.db_file)
+        return conn.cursor()
+
+    def __len__(self) -> int:
+        return self._read_cursor().execute("SELECT COUNT(*) FROM code_fts").fetchone()[0]
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Returns (id, BM25 score) pairs, best first. Higher scores are better."""
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        cursor = self._read_cursor()
+        cursor.execute(
+            "SELECT rowid, bm25(code_fts) FROM code_fts WHERE code_fts MATCH ? "
+            "ORDER BY bm25(code_fts) LIMIT ?",
+            (expression, top_k),
+        )
+        # FTS5 reports BM25 negated so that ascending order is best first
+        return [(idx, -score) for idx, score in cursor.fetchall()]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[int]],
+    weights: Optional[Sequence[float]] = None,
+    k: int = RRF_K,
+) -> List[Tuple[int, float]]:
+    """Fuses ranked id lists by summing weight / (k + rank). Returns (id, score), best first."""
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[int, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, idx in enumerate(ranking, start=1):
+            fused[idx] += weight / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
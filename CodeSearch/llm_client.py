@@ -0,0 +1,252 @@
+# LLM client layer for the Ollama (OpenAI-compatible) endpoint.
+#
+# Connections come from an explicitly sized httpx pool and are kept alive between
+# calls, so re-ranking doesn't pay a TCP handshake per snippet. Every call can carry
+# the Deadline of the search request that made it: per-attempt timeouts shrink to the
+# time that is left, retries back off exponentially with full jitter, and no retry
+# starts once the deadline can't be met. Callers fall back to the dense ordering.
+# Token usage is counted per attempt; tokens spent on replies that were rejected
+# (unparseable, e.g. a reasoning model thinking aloud) are counted as wasted.
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+T = TypeVar("T")
+
+KEEPALIVE_EXPIRY = 60.0
+CONNECT_TIMEOUT = 5.0
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4.0
+
+
+class Deadline:
+    """Absolute time budget for one search request; None means no deadline."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def wait_timeout(self) -> Optional[float]:
+        """Timeout for blocking waits: the time left, or None to wait indefinitely."""
+        return None if self.expires_at is None else self.remaining()
+
+    def timeout(self, cap: float) -> float:
+        """The smaller of cap and the time left."""
+        return min(cap, self.remaining())
+
+
+NO_DEADLINE = Deadline(None)
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def reply_text(choice: Any) -> str:
+    """Message text of a completion choice; empty if the model returned none."""
+    return choice.message.content or ""
+
+
+def pool_limits(pool_size: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+class _RetryPolicy:
+    """Retry bookkeeping shared by the sync and async clients."""
+
+    def __init__(self, timeout: float, backoff_base: float, backoff_cap: float):
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, int] = {
+            "calls": 0, "attempts": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0,
+            "parse_failures": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "wasted_prompt_tokens": 0, "wasted_completion_tokens": 0,
+        }
+
+    def count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def accept(self, completion: Any, parse: Callable[[Any], Optional[T]], attempt: int) -> Optional[T]:
+        """parse(choice) of a completion, with its token usage counted."""
+        value = parse(completion.choices[0])
+        usage = completion.usage
+        if usage is not None:
+            self.count("prompt_tokens", usage.prompt_tokens or 0)
+            self.count("completion_tokens", usage.completion_tokens or 0)
+        if value is None:
+            self.count("parse_failures")
+            if usage is not None:
+                self.count("wasted_prompt_tokens", usage.prompt_tokens or 0)
+                self.count("wasted_completion_tokens", usage.completion_tokens or 0)
+            print(f"Warning: Unable to parse LLM output (Attempt {attempt + 1}).")
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def attempt_timeout(self, deadline: Deadline, timeout: Optional[float]) -> Optional[float]:
+        """Per-attempt timeout, or None when the deadline has already passed."""
+        if deadline.expired():
+            self.count("deadline_exceeded")
+            return None
+        return deadline.timeout(timeout if timeout is not None else self.timeout)
+
+    def retry_delay(self, attempt: int, retries: int, deadline: Deadline) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up."""
+        if attempt + 1 >= retries:
+            return None
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_cap)
+        if deadline.remaining() <= delay:
+            self.count("deadline_exceeded")
+            return None
+        self.count("retries")
+        return delay
+
+
+class LLMClient(_RetryPolicy):
+    """Blocking client for the search threads."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        pool_size: int = 4,
+        timeout: float = 30.0,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_cap: float = BACKOFF_CAP,
+    ):
+        super().__init__(timeout, backoff_base, backoff_cap)
+        http_client = httpx.Client(
+            limits=pool_limits(pool_size),
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+        )
+        # Retries are ours, so they can respect the deadline
+        self.client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client)
+
+    def complete(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: int,
+        parse: Callable[[Any], Optional[T]],
+        retries: int = 3,
+        temperature: float = 0.2,
+        timeout: Optional[float] = None,
+        deadline: Deadline = NO_DEADLINE,
+        **options: Any,
+    ) -> Optional[T]:
+        """Returns parse(choice) for the first reply it accepts, or None once out of attempts or time.
+
+        options are passed through to chat.completions.create (response_format, logprobs, ...).
+        """
+        self.count("calls")
+        for attempt in range(retries):
+            attempt_timeout = self.attempt_timeout(deadline, timeout)
+            if attempt_timeout is None:
+                break
+            self.count("attempts")
+            try:
+                completion = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=attempt_timeout,
+                    **options,
+                )
+                value = self.accept(completion, parse, attempt)
+                if value is not None:
+                    return value
+            except Exception as e:
+                print(f"Error during LLM call (Attempt {attempt + 1}): {e}")
+            delay = self.retry_delay(attempt, retries, deadline)
+            if delay is None:
+                break
+            time.sleep(delay)
+        self.count("failures")
+        return None
+
+
+class AsyncLLMClient(_RetryPolicy):
+    """Non-blocking client for the asyncio API server."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        pool_size: int = 64,
+        timeout: float = 30.0,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_cap: float = BACKOFF_CAP,
+    ):
+        super().__init__(timeout, backoff_base, backoff_cap)
+        http_client = httpx.AsyncClient(
+            limits=pool_limits(pool_size),
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+        )
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client)
+
+    async def complete(
+        self,
+        model: str,
+        messages: List[dict],
+        max_tokens: int,
+        parse: Callable[[Any], Optional[T]],
+        retries: int = 3,
+        temperature: float = 0.2,
+        timeout: Optional[float] = None,
+        deadline: Deadline = NO_DEADLINE,
+        **options: Any,
+    ) -> Optional[T]:
+        """Async LLMClient.complete."""
+        self.count("calls")
+        for attempt in range(retries):
+            attempt_timeout = self.attempt_timeout(deadline, timeout)
+            if attempt_timeout is None:
+                break
+            self.count("attempts")
+            try:
+                completion = await self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    timeout=attempt_timeout,
+                    **options,
+                )
+                value = self.accept(completion, parse, attempt)
+                if value is not None:
+                    return value
+            except Exception as e:
+                print(f"Error during LLM call (Attempt {attempt + 1}): {e}")
+            delay = self.retry_delay(attempt, retries, deadline)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        self.count("failures")
+        return None
+
+    async def close(self):
+        await self.client.close()
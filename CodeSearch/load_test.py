@@ -0,0 +1,107 @@
+# Load test for the async search API (api_server.py). Keeps --concurrency requests in
+# flight until --requests have completed, then reports throughput and latency:
+#
+#   python3 CodeSearch/load_test.py --concurrency 200 --requests 2000
+#   python3 CodeSearch/load_test.py --concurrency 200 --no_rerank --unique
+
+import argparse
+import asyncio
+import time
+from typing import List
+
+import aiohttp
+import numpy as np
+
+SAMPLE_QUERIES = [
+    "read a json file into a dictionary",
+    "download a file from a url",
+    "parse command line arguments",
+    "sort a list of dictionaries by key",
+    "connect to a sqlite database and run a query",
+    "compute the md5 hash of a file",
+    "flatten a nested list",
+    "convert a datetime to a unix timestamp",
+    "retry a function call with exponential backoff",
+    "split a string on whitespace and punctuation",
+]
+
+
+def load_queries(path: str) -> List[str]:
+    if path is None:
+        return SAMPLE_QUERIES
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+async def run_load(args) -> dict:
+    queries = load_queries(args.queries_file)
+    latencies: List[float] = []
+    errors = 0
+    next_request = 0
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal errors, next_request
+        while next_request < args.requests:
+            number = next_request
+            next_request += 1
+            query = queries[number % len(queries)]
+            if args.unique:
+                # Defeats the query embedding and LLM score caches
+                query = f"{query} {number}"
+            start = time.perf_counter()
+            try:
+                async with session.post(
+                    args.url, json={"query": query, "rerank": not args.no_rerank}
+                ) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Request {number} failed: {e}")
+                errors += 1
+                continue
+            latencies.append(1000 * (time.perf_counter() - start))
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "seconds": elapsed,
+        "requests/s": len(latencies) / elapsed,
+        "p50 ms": float(np.percentile(latencies, 50)) if latencies else 0.0,
+        "p95 ms": float(np.percentile(latencies, 95)) if latencies else 0.0,
+        "p99 ms": float(np.percentile(latencies, 99)) if latencies else 0.0,
+        "max ms": float(np.max(latencies)) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:5003/api/search", type=str)
+    parser.add_argument("--concurrency", default=200, type=int,
+                        help="Requests kept in flight at once.")
+    parser.add_argument("--requests", default=1000, type=int)
+    parser.add_argument("--queries_file", default=None, type=str,
+                        help="One query per line; a built-in sample is used otherwise.")
+    parser.add_argument("--unique", action="store_true",
+                        help="Make every query distinct so no cache is hit.")
+    parser.add_argument("--no_rerank", action="store_true",
+                        help="Skip LLM scoring to measure embedding and retrieval alone.")
+    parser.add_argument("--timeout", default=300, type=float)
+    args = parser.parse_args()
+
+    summary = asyncio.run(run_load(args))
+    for key, value in summary.items():
+        print(f"{key:>12}: {value:.1f}" if isinstance(value, float) else f"{key:>12}: {value}")
+
+
+if __name__ == "__main__":
+    main()
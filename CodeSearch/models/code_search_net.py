@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, NamedTuple
 from pydantic import BaseModel
 
 class DataPoint(BaseModel):
@@ -16,4 +16,8 @@ class DataPoint(BaseModel):
     func_code_url: str
 
 
-
+class IndexRecord(NamedTuple):
+    """The fields of a CodeSearchNet function that indexing actually reads."""
+    id: int
+    func_documentation_string: str
+    whole_func_string: str
@@ -0,0 +1,371 @@
+# Latency/recall benchmarks for the search backends. Run from the directory holding embeddings.db:
+#
+#   python CodeSearch/perf_benchmark.py ann --n_probe 1 2 4 8 16 32
+#   python CodeSearch/perf_benchmark.py storage --rows 20000
+#   python CodeSearch/perf_benchmark.py quantization
+#   python CodeSearch/perf_benchmark.py pq --pq_subvectors 48 96 192
+#   python CodeSearch/perf_benchmark.py bm25
+
+import argparse
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from unixcoder import top_k_indices
+
+from ann_index import IVF_INDEX_FILE, IVFIndex
+from embedding_file import blobs_to_matrix, load_embedding_matrix
+from embedding_store import RESCORE_FACTOR
+from lexical_index import SUBTOKEN_RE, LexicalIndex, build_lexical_index
+from pq_index import PQIndex
+from quantization import QUANTIZATION_DTYPES, ScalarQuantizer
+from storage import DB_FILE, connect, create_schema, fetch_code_strings, insert_entries
+
+
+def exact_search(matrix: np.ndarray, ids: np.ndarray, query: np.ndarray, top_k: int):
+    """Exhaustive ranking over every stored vector, the reference for recall."""
+    scores = matrix @ query
+    top_indices = top_k_indices(scores, top_k)
+    return [(int(ids[i]), float(scores[i])) for i in top_indices]
+
+
+def sample_queries(ids: np.ndarray, matrix: np.ndarray, n_queries: int, seed: int):
+    """Uses stored vectors as queries; each query's own row is excluded from its results."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(ids), min(n_queries, len(ids)), replace=False)
+    return [(int(ids[row]), np.asarray(matrix[row], dtype=np.float32)) for row in rows]
+
+
+def run_queries(
+    search_fn: Callable[[np.ndarray, int], List[Tuple[int, float]]],
+    queries: List[Tuple[int, np.ndarray]],
+    top_k: int,
+) -> Tuple[List[List[int]], float]:
+    """Returns the result ids per query (self match removed) and the mean latency in ms."""
+    results = []
+    start = time.perf_counter()
+    for query_id, query in queries:
+        hits = search_fn(query, top_k + 1)
+        results.append([idx for idx, _ in hits if idx != query_id][:top_k])
+    elapsed = time.perf_counter() - start
+    return results, 1000 * elapsed / max(len(queries), 1)
+
+
+def recall_at_k(exact: List[List[int]], approx: List[List[int]]) -> float:
+    return float(np.mean([len(set(e) & set(a)) / max(len(e), 1) for e, a in zip(exact, approx)]))
+
+
+def report(rows: List[Dict[str, object]]):
+    keys = list(rows[0].keys())
+    print(" | ".join(f"{key:>14}" for key in keys))
+    for row in rows:
+        print(" | ".join(
+            f"{value:>14.4f}" if isinstance(value, float) else f"{value!s:>14}"
+            for value in row.values()
+        ))
+
+
+def benchmark_ann(args):
+    ids, matrix = load_embedding_matrix(args.db_file)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    print(f"Loaded {len(ids)} embeddings of dimension {matrix.shape[1]}")
+    queries = sample_queries(ids, matrix, args.n_queries, args.seed)
+
+    exact, exact_ms = run_queries(
+        lambda q, k: exact_search(matrix, ids, q, k), queries, args.top_k
+    )
+
+    if args.rebuild or not os.path.exists(args.index_file):
+        start = time.perf_counter()
+        index = IVFIndex.build(ids, matrix, n_lists=args.n_lists, seed=args.seed)
+        print(f"Built {index.n_lists}-list IVF index in {time.perf_counter() - start:.1f}s")
+    else:
+        index = IVFIndex.load(args.index_file)
+
+    rows = [{"backend": "exact", "n_probe": "-", "ms/query": exact_ms, f"recall@{args.top_k}": 1.0}]
+    for n_probe in args.n_probe:
+        approx, approx_ms = run_queries(
+            lambda q, k: index.search(q, k, n_probe=n_probe), queries, args.top_k
+        )
+        rows.append({
+            "backend": "ivf",
+            "n_probe": n_probe,
+            "ms/query": approx_ms,
+            f"recall@{args.top_k}": recall_at_k(exact, approx),
+        })
+    report(rows)
+
+
+def benchmark_quantization(args):
+    ids, matrix = load_embedding_matrix(args.db_file)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    print(f"Loaded {len(ids)} embeddings of dimension {matrix.shape[1]}")
+    queries = sample_queries(ids, matrix, args.n_queries, args.seed)
+
+    exact, exact_ms = run_queries(
+        lambda q, k: exact_search(matrix, ids, q, k), queries, args.top_k
+    )
+    rows = [{
+        "dtype": "float32",
+        "rescore": "-",
+        "bytes/vector": matrix.shape[1] * 4,
+        "ms/query": exact_ms,
+        f"recall@{args.top_k}": 1.0,
+    }]
+
+    for dtype in args.dtypes:
+        quantizer = ScalarQuantizer.train(matrix, dtype, seed=args.seed)
+        codes = quantizer.encode(matrix)
+
+        def quantized_search(q, k, rescore):
+            scores = quantizer.scores(codes, q)
+            top_indices = top_k_indices(scores, k * RESCORE_FACTOR if rescore else k)
+            if rescore:
+                scores = np.zeros_like(scores)
+                scores[top_indices] = matrix[top_indices] @ q
+                top_indices = top_indices[np.argsort(-scores[top_indices], kind="stable")][:k]
+            return [(int(ids[i]), float(scores[i])) for i in top_indices]
+
+        for rescore in (False, True):
+            approx, approx_ms = run_queries(
+                lambda q, k: quantized_search(q, k, rescore), queries, args.top_k
+            )
+            rows.append({
+                "dtype": dtype,
+                "rescore": rescore,
+                "bytes/vector": quantizer.bytes_per_vector,
+                "ms/query": approx_ms,
+                f"recall@{args.top_k}": recall_at_k(exact, approx),
+            })
+    report(rows)
+
+
+def benchmark_pq(args):
+    ids, matrix = load_embedding_matrix(args.db_file)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    print(f"Loaded {len(ids)} embeddings of dimension {matrix.shape[1]}")
+    queries = sample_queries(ids, matrix, args.n_queries, args.seed)
+    row_of = {int(idx): row for row, idx in enumerate(ids)}
+
+    exact, exact_ms = run_queries(
+        lambda q, k: exact_search(matrix, ids, q, k), queries, args.top_k
+    )
+    rows = [{
+        "backend": "exact",
+        "rescore": "-",
+        "bytes/vector": matrix.shape[1] * 4,
+        "ms/query": exact_ms,
+        f"recall@{args.top_k}": 1.0,
+    }]
+
+    for n_subvectors in args.pq_subvectors:
+        start = time.perf_counter()
+        index = PQIndex.build(ids, matrix, n_subvectors=n_subvectors, seed=args.seed)
+        print(f"Built {n_subvectors}-subvector PQ index in {time.perf_counter() - start:.1f}s")
+
+        def pq_search(q, k, rescore):
+            hits = index.search(q, k * RESCORE_FACTOR if rescore else k)
+            if not rescore:
+                return hits
+            rescored = [(idx, float(matrix[row_of[idx]] @ q)) for idx, _ in hits]
+            return sorted(rescored, key=lambda x: x[1], reverse=True)[:k]
+
+        for rescore in (False, True):
+            approx, approx_ms = run_queries(
+                lambda q, k: pq_search(q, k, rescore), queries, args.top_k
+            )
+            rows.append({
+                "backend": f"pq{n_subvectors}",
+                "rescore": rescore,
+                "bytes/vector": index.bytes_per_vector,
+                "ms/query": approx_ms,
+                f"recall@{args.top_k}": recall_at_k(exact, approx),
+            })
+    report(rows)
+
+
+def benchmark_bm25(args):
+    with connect(args.db_file) as conn:
+        added = build_lexical_index(conn.cursor())
+        conn.commit()
+    if added:
+        print(f"Indexed {added} new rows into code_fts")
+    index = LexicalIndex(args.db_file)
+    print(f"BM25 index holds {len(index)} functions")
+
+    # Queries are function names, as typed and as plain words; the hit is the function itself
+    rng = np.random.default_rng(args.seed)
+    with connect(args.db_file) as conn:
+        rows = conn.execute("SELECT id, code_string FROM code_strings").fetchall()
+    queries = []
+    for row in rng.permutation(len(rows)):
+        idx, code = rows[row]
+        name = re.search(r"def\s+(\w+)", code or "")
+        if name:
+            queries.append((idx, name.group(1)))
+        if len(queries) == args.n_queries:
+            break
+
+    results = []
+    for form, make_query in (
+        ("identifier", lambda name: name),
+        ("words", lambda name: " ".join(part.lower() for part in SUBTOKEN_RE.findall(name))),
+    ):
+        latencies, hits = [], 0
+        for idx, name in queries:
+            start = time.perf_counter()
+            found = index.search(make_query(name), top_k=args.top_k)
+            latencies.append(1000 * (time.perf_counter() - start))
+            hits += idx in {hit for hit, _ in found}
+        results.append({
+            "query": form,
+            "queries": len(queries),
+            "p50 ms": float(np.percentile(latencies, 50)),
+            "p95 ms": float(np.percentile(latencies, 95)),
+            f"hit@{args.top_k}": hits / max(len(queries), 1),
+        })
+    report(results)
+
+
+def legacy_schema(cursor: sqlite3.Cursor):
+    """The original single-table layout with default journaling, for comparison."""
+    cursor.execute(
+        "CREATE TABLE embeddings (id INTEGER PRIMARY KEY, code_string TEXT, embedding BLOB)"
+    )
+
+
+def legacy_insert(entries, cursor: sqlite3.Cursor):
+    cursor.executemany(
+        "INSERT INTO embeddings (id, code_string, embedding) VALUES (?, ?, ?)",
+        [(i, code, emb.tobytes()) for i, code, emb in entries],
+    )
+
+
+def legacy_code_strings(cursor: sqlite3.Cursor, ids):
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(
+        f"SELECT id, code_string FROM embeddings WHERE id IN ({placeholders})", [int(i) for i in ids]
+    )
+    return dict(cursor.fetchall())
+
+
+STORAGE_LAYOUTS = {
+    "legacy": (sqlite3.connect, legacy_schema, legacy_insert, legacy_code_strings),
+    "tuned": (connect, create_schema, insert_entries, fetch_code_strings),
+}
+
+
+def benchmark_storage(args):
+    rng = np.random.default_rng(args.seed)
+    code = "x" * args.code_bytes
+    rows = []
+    for layout, (open_db, make_schema, insert, code_strings) in STORAGE_LAYOUTS.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = os.path.join(tmp, "embeddings.db")
+            writer = open_db(db_file)
+            make_schema(writer.cursor())
+            writer.commit()
+
+            # A search worker fetching result text while the indexer commits batches
+            stop = threading.Event()
+            read_ms: List[float] = []
+            locked = [0]
+
+            def reader():
+                conn = open_db(db_file)
+                reader_rng = np.random.default_rng(args.seed + 1)
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        code_strings(conn.cursor(), reader_rng.integers(0, args.rows, 10).tolist())
+                    except sqlite3.OperationalError:
+                        locked[0] += 1
+                    read_ms.append(1000 * (time.perf_counter() - start))
+                    time.sleep(0.001)  # a steady request rate rather than a busy loop
+                conn.close()
+
+            reader_thread = threading.Thread(target=reader)
+            reader_thread.start()
+            start = time.perf_counter()
+            for first in range(0, args.rows, args.batch_rows):
+                batch = range(first, min(first + args.batch_rows, args.rows))
+                vectors = rng.standard_normal((len(batch), args.dim), dtype=np.float32)
+                insert([(i, code, vectors[j]) for j, i in enumerate(batch)], writer.cursor())
+                writer.commit()
+            insert_seconds = time.perf_counter() - start
+            stop.set()
+            reader_thread.join()
+
+            start = time.perf_counter()
+            cursor = writer.cursor()
+            cursor.execute("SELECT embedding FROM embeddings")
+            matrix = blobs_to_matrix(blob for (blob,) in cursor)
+            scan_seconds = time.perf_counter() - start
+            writer.close()
+
+            rows.append({
+                "layout": layout,
+                "insert rows/s": args.rows / insert_seconds,
+                "scan rows/s": len(matrix) / scan_seconds,
+                "read p50 ms": float(np.percentile(read_ms, 50)) if read_ms else 0.0,
+                "read max ms": float(np.max(read_ms)) if read_ms else 0.0,
+                "locked errors": locked[0],
+            })
+    report(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db_file", default=DB_FILE, type=str)
+    parser.add_argument("--n_queries", default=200, type=int)
+    parser.add_argument("--top_k", default=10, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ann = subparsers.add_parser("ann", help="IVF index recall and latency vs. exact search.")
+    ann.add_argument("--index_file", default=IVF_INDEX_FILE, type=str,
+                     help="Saved index to evaluate; built in memory when missing or with --rebuild.")
+    ann.add_argument("--rebuild", action="store_true")
+    ann.add_argument("--n_lists", default=None, type=int)
+    ann.add_argument("--n_probe", default=[1, 2, 4, 8, 16, 32], type=int, nargs="+")
+    ann.set_defaults(func=benchmark_ann)
+
+    quantization = subparsers.add_parser(
+        "quantization", help="float16/int8 scan memory, latency and recall vs. float32."
+    )
+    quantization.add_argument("--dtypes", default=list(QUANTIZATION_DTYPES), nargs="+",
+                              choices=QUANTIZATION_DTYPES)
+    quantization.set_defaults(func=benchmark_quantization)
+
+    pq = subparsers.add_parser("pq", help="PQ index memory, latency and recall vs. exact search.")
+    pq.add_argument("--pq_subvectors", default=[48, 96, 192], type=int, nargs="+",
+                    help="Bytes per vector; each must divide the embedding dimension.")
+    pq.set_defaults(func=benchmark_pq)
+
+    bm25 = subparsers.add_parser(
+        "bm25", help="BM25 latency and function-name hit rate over the whole corpus."
+    )
+    bm25.set_defaults(func=benchmark_bm25)
+
+    storage = subparsers.add_parser(
+        "storage", help="Insert and scan throughput of the SQLite layout, with a concurrent reader."
+    )
+    storage.add_argument("--rows", default=20000, type=int)
+    storage.add_argument("--dim", default=768, type=int)
+    storage.add_argument("--batch_rows", default=256, type=int,
+                         help="Rows per committed insert batch.")
+    storage.add_argument("--code_bytes", default=2000, type=int,
+                         help="Size of the synthetic code_string stored with each row.")
+    storage.set_defaults(func=benchmark_storage)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
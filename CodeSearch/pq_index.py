@@ -0,0 +1,156 @@
+# Product-quantization (PQ) index for corpora whose float32 matrix doesn't fit in memory.
+#
+# Each vector is split into n_subvectors slices and every slice is replaced by the
+# uint8 id of its nearest centroid in that slice's 256-entry codebook, so a 768-d
+# vector costs n_subvectors bytes instead of 3072. A query builds one table of
+# slice . centroid dot products per subspace (asymmetric distance computation) and a
+# row's score is the sum of the table entries its codes select.
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+from unixcoder import top_k_indices
+
+from ann_index import assign_to_centroids, kmeans
+
+PQ_INDEX_FILE = "embeddings_pq.npz"
+
+# Rows scored per block, so each block's partial sums stay in cache across subspaces
+SCORE_BLOCK_ROWS = 16384
+
+
+class PQIndex:
+    """uint8 PQ codes per id, scored against per-query lookup tables.
+
+    Codes are stored subspace-major, (n_subvectors, rows), so scoring reads one
+    contiguous run of codes per subspace. ids and codes are published together as one
+    tuple, so a concurrent search never sees one grown without the other.
+    """
+
+    # Scores are approximations; callers holding float32 vectors may re-rank
+    exact_scores = False
+
+    def __init__(self, codebooks: np.ndarray, ids: np.ndarray, codes: np.ndarray):
+        self.codebooks = codebooks  # (n_subvectors, n_centroids, sub_dim)
+        self.rows: Tuple[np.ndarray, np.ndarray] = (ids, codes)  # codes: (n_subvectors, rows) uint8
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self.rows[0]
+
+    @property
+    def codes(self) -> np.ndarray:
+        return self.rows[1]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def n_subvectors(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.n_subvectors * self.codes.itemsize
+
+    @classmethod
+    def build(
+        cls,
+        ids: np.ndarray,
+        matrix: np.ndarray,
+        n_subvectors: int = 96,
+        n_centroids: int = 256,
+        n_iter: int = 20,
+        train_size: int = 65_536,
+        seed: int = 0,
+    ) -> "PQIndex":
+        """Trains one Euclidean k-means codebook per subspace on a sample, then encodes every row."""
+        dim = matrix.shape[1]
+        if dim % n_subvectors:
+            raise ValueError(f"n_subvectors={n_subvectors} must divide the dimension {dim}")
+        if n_centroids > 256:
+            raise ValueError("PQ codes are uint8, so n_centroids must be at most 256")
+        sub_dim = dim // n_subvectors
+
+        rng = np.random.default_rng(seed)
+        sample = matrix
+        if len(matrix) > train_size:
+            sample = matrix[np.sort(rng.choice(len(matrix), train_size, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+        n_centroids = min(n_centroids, len(sample))
+
+        codebooks = np.stack([
+            kmeans(sample[:, m * sub_dim : (m + 1) * sub_dim], n_centroids, n_iter=n_iter, seed=seed + m)
+            for m in range(n_subvectors)
+        ])
+        index = cls(
+            codebooks,
+            np.empty(0, dtype=np.int64),
+            np.empty((n_subvectors, 0), dtype=np.uint8),
+        )
+        index.add(ids, matrix)
+        return index
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """Returns (n_subvectors, rows) codes for the vectors."""
+        sub_dim = self.codebooks.shape[2]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((self.n_subvectors, len(vectors)), dtype=np.uint8)
+        for m, codebook in enumerate(self.codebooks):
+            codes[m] = assign_to_centroids(
+                vectors[:, m * sub_dim : (m + 1) * sub_dim], codebook, euclidean=True
+            )
+        return codes
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        if len(ids) == 0:
+            return
+        old_ids, old_codes = self.rows
+        self.rows = (
+            np.concatenate([old_ids, np.asarray(ids, dtype=np.int64)]),
+            np.concatenate([old_codes, self.encode(vectors)], axis=1),
+        )
+
+    def retain(self, ids: np.ndarray):
+        """Drops every indexed row whose id isn't in ids."""
+        old_ids, old_codes = self.rows
+        keep = np.isin(old_ids, ids)
+        self.rows = (old_ids[keep], old_codes[:, keep])
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Boolean mask of which ids are already indexed."""
+        return np.isin(ids, self.ids)
+
+    def lookup_tables(self, query_embedding: np.ndarray) -> np.ndarray:
+        """(n_subvectors, n_centroids) dot products of each query slice with its codebook."""
+        query_slices = np.asarray(query_embedding, dtype=np.float32).reshape(self.n_subvectors, -1)
+        return np.einsum("mkd,md->mk", self.codebooks, query_slices)
+
+    def search(
+        self, query_embedding: np.ndarray, top_k: int = 10, n_probe: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """Returns (id, approximate score) pairs for the top_k rows. n_probe is unused."""
+        ids, all_codes = self.rows  # one snapshot, so sizes agree
+        if len(ids) == 0:
+            return []
+        tables = self.lookup_tables(query_embedding)
+        scores = np.empty(len(ids), dtype=np.float32)
+        lookups = np.empty(SCORE_BLOCK_ROWS, dtype=np.float32)
+        for start in range(0, len(ids), SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, len(ids))
+            block_scores, block_lookups = scores[start:end], lookups[: end - start]
+            block_scores[...] = 0
+            for table, codes in zip(tables, all_codes):
+                np.take(table, codes[start:end], out=block_lookups)
+                block_scores += block_lookups
+        top_indices = top_k_indices(scores, top_k)
+        return [(int(ids[i]), float(scores[i])) for i in top_indices]
+
+    def save(self, path: str = PQ_INDEX_FILE):
+        with open(path, "wb") as f:
+            np.savez(f, codebooks=self.codebooks, ids=self.ids, codes=self.codes)
+
+    @classmethod
+    def load(cls, path: str = PQ_INDEX_FILE) -> "PQIndex":
+        with np.load(path) as data:
+            return cls(data["codebooks"], data["ids"], data["codes"])
@@ -0,0 +1,79 @@
+# Bounded LRU cache of query embeddings, with an optional SQLite tier that survives restarts.
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+QUERY_CACHE_FILE = "embeddings_query_cache.db"
+
+
+def normalize_query(query: str, lowercase: bool = False) -> str:
+    """Collapses whitespace. Query embeddings keep case (the model sees it); the LLM
+    score cache passes lowercase=True so case-only variants share a score."""
+    query = " ".join(query.split())
+    return query.lower() if lowercase else query
+
+
+class QueryEmbeddingCache:
+    """In-memory LRU of normalized query embeddings keyed by model, max_length and query text."""
+
+    def __init__(self, max_entries: int = 1024, disk_file: Optional[str] = None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk_file is not None:
+            self._conn = sqlite3.connect(disk_file, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, embedding BLOB)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def key(model_name: str, max_length: int, query: str) -> str:
+        return hashlib.sha256(
+            f"{model_name}\0{max_length}\0{normalize_query(query)}".encode("utf-8")
+        ).hexdigest()
+
+    def _remember(self, key: str, embedding: np.ndarray):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return embedding
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT embedding FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, embedding)
+                    self.hits += 1
+                    return embedding
+            self.misses += 1
+            return None
+
+    def put(self, key: str, embedding: np.ndarray):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding.setflags(write=False)  # shared between callers
+        with self._lock:
+            self._remember(key, embedding)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, embedding) VALUES (?, ?)",
+                    (key, embedding.tobytes()),
+                )
+                self._conn.commit()
@@ -0,0 +1,92 @@
+# Re-rankers for the last cascade stage. Both take a query and its top snippets and
+# return (snippet, score) pairs, best first, so search.py, api_server.py and
+# benchmarking.py can swap one for the other:
+#
+#   LLMRanker           one LLM call per snippet (or per batch), seconds per query
+#   CrossEncoderRanker  one batched forward pass of the UniXcoder cross-encoder
+
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from cross_encoder import CROSS_ENCODER_BATCH_SIZE, CrossEncoder
+from llm_client import NO_DEADLINE, Deadline
+
+RANKERS = ("llm", "cross_encoder")
+
+# How LLMRanker scores the top snippets: one call per snippet in order, in parallel,
+# or one batched call
+SCORING_MODES = ("sequential", "concurrent", "batched")
+
+Ranking = List[Tuple[str, Optional[float]]]
+
+
+class Ranker(ABC):
+    """Orders a query's snippets by relevance. A None score means the snippet wasn't scored."""
+
+    name = "ranker"
+    label = "Ranker"
+
+    @abstractmethod
+    def rank(self, user_input: str, snippets: List[str], deadline: Deadline = NO_DEADLINE) -> Ranking:
+        """(snippet, score) pairs, best first."""
+
+    def iter_scores(
+        self, user_input: str, snippets: List[str], deadline: Deadline = NO_DEADLINE
+    ) -> Iterator[Tuple[int, Optional[float]]]:
+        """(index into snippets, score) for each scored snippet; all at once by default."""
+        indices = {snippet: i for i, snippet in enumerate(snippets)}
+        for snippet, score in self.rank(user_input, snippets, deadline=deadline):
+            if score is not None:
+                yield indices[snippet], score
+
+
+class LLMRanker(Ranker):
+    """Wraps search.rank_snippets_by_mode and search.iter_snippet_scores."""
+
+    name = "llm"
+    label = "LLM"
+
+    def __init__(
+        self,
+        rank_fn: Callable[..., Ranking],
+        iter_fn: Optional[Callable[..., Iterator[Tuple[int, Optional[float]]]]] = None,
+        mode: Optional[str] = None,
+        verbose: bool = False,
+    ):
+        self.rank_fn = rank_fn
+        self.iter_fn = iter_fn
+        self.mode = mode
+        self.verbose = verbose
+
+    def _mode_kwargs(self) -> dict:
+        return {} if self.mode is None else {"mode": self.mode}
+
+    def rank(self, user_input: str, snippets: List[str], deadline: Deadline = NO_DEADLINE) -> Ranking:
+        return self.rank_fn(
+            user_input, snippets, verbose=self.verbose, deadline=deadline, **self._mode_kwargs()
+        )
+
+    def iter_scores(
+        self, user_input: str, snippets: List[str], deadline: Deadline = NO_DEADLINE
+    ) -> Iterator[Tuple[int, Optional[float]]]:
+        if self.iter_fn is None:
+            return super().iter_scores(user_input, snippets, deadline=deadline)
+        return self.iter_fn(user_input, snippets, deadline=deadline, **self._mode_kwargs())
+
+
+class CrossEncoderRanker(Ranker):
+    """Scores every snippet against the query in one batched forward pass."""
+
+    name = "cross_encoder"
+    label = "Cross-Encoder"
+
+    def __init__(self, cross_encoder: CrossEncoder, batch_size: int = CROSS_ENCODER_BATCH_SIZE):
+        self.cross_encoder = cross_encoder
+        self.batch_size = batch_size
+
+    def rank(self, user_input: str, snippets: List[str], deadline: Deadline = NO_DEADLINE) -> Ranking:
+        if deadline.expired():
+            # Keep the dense order, like the LLM rankers do
+            return [(snippet, None) for snippet in snippets]
+        scores = self.cross_encoder.score(user_input, snippets, batch_size=self.batch_size)
+        return sorted(zip(snippets, scores), key=lambda x: x[1], reverse=True)
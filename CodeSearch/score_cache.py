@@ -0,0 +1,118 @@
+# Persistent cache of LLM relevance scores so repeated (model, variant, query, snippet) keys skip the LLM.
+# The variant separates scores that aren't interchangeable: each single-snippet score
+# format, and the batched prompt.
+
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from query_cache import normalize_query
+
+SCORE_CACHE_FILE = "embeddings_score_cache.db"
+
+
+def cache_key(model: str, query: str, snippet: str, variant: str = "") -> str:
+    digest = hashlib.sha256()
+    for part in (model, variant, normalize_query(query, lowercase=True), snippet):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ScoreCache:
+    """SQLite-backed score cache with TTL expiry and least-recently-used eviction.
+
+    Hits only read: their last_used times are kept in memory and written in one
+    batch every evict_every hits or puts, so the hot path never commits.
+    """
+
+    def __init__(
+        self,
+        db_file: str = SCORE_CACHE_FILE,
+        max_entries: int = 100_000,
+        ttl_seconds: Optional[float] = 7 * 24 * 3600,
+        evict_every: int = 500,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._touched: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS scores (
+                key TEXT PRIMARY KEY,
+                score REAL,
+                created_at REAL,
+                last_used REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self._conn.commit()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, model: str, query: str, snippet: str, variant: str = "") -> Optional[float]:
+        key = cache_key(model, query, snippet, variant)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score, created_at FROM scores WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1], now):
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.evict_every:
+                self._flush_touched()
+                self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model: str, query: str, snippet: str, score: float, variant: str = ""):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scores (key, score, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (cache_key(model, query, snippet, variant), score, now, now),
+            )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict(now)
+            self._conn.commit()
+
+    def _flush_touched(self):
+        self._conn.executemany(
+            "UPDATE scores SET last_used = ? WHERE key = ?",
+            [(last_used, key) for key, last_used in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def _evict(self, now: float):
+        # LRU order needs the pending last_used times
+        self._flush_touched()
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM scores WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            """DELETE FROM scores WHERE key IN (
+                SELECT key FROM scores ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )""",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
@@ -1,27 +1,87 @@
+import json
+import math
 import os
-import sqlite3
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from datasets.arrow_dataset import re
-from flask import Flask, render_template, request
-from openai import OpenAI
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 
 from transformers import pipeline
 
+from ann_index import IVF_INDEX_FILE, IVFIndex
 from data_processing import DB_FILE
-from search_processing import get_processed_data, get_top_ten, process_user_code_segment
+from cascade import SearchCascade
+from cross_encoder import CrossEncoder
+from embedding_store import EmbeddingStore
+from lexical_index import LexicalIndex
+from llm_client import NO_DEADLINE, Deadline, LLMClient, reply_text
+from pq_index import PQ_INDEX_FILE, PQIndex
+from quantization import QUANTIZER_FILE, ScalarQuantizer
+from rankers import RANKERS, SCORING_MODES, CrossEncoderRanker, LLMRanker
+from score_cache import SCORE_CACHE_FILE, ScoreCache
+from search_processing import device, embedding_batcher, process_user_code_segment, query_cache
 
 app = Flask(
     __name__,
     template_folder="templates",
     static_folder="static"
 )
-# Set up the OpenRouter client
-client = OpenAI(
-    base_url="http://127.0.0.1:11434/v1",
-    api_key="CHICKEN JOCKEY (IM STUPID) api key is redundant but the openai library requires it, ollama is compatible with the library just being dumb",
+# Ollama's OpenAI-compatible endpoint; the client is created with the pool settings below
+LLM_BASE_URL = "http://127.0.0.1:11434/v1"
+LLM_API_KEY = "CHICKEN JOCKEY (IM STUPID) api key is redundant but the openai library requires it, ollama is compatible with the library just being dumb"
+# Optional float16/int8 scan with the quantizer from `create_data.py --quantize`;
+# EMBEDDING_RESCORE=0 skips re-ranking the top candidates in float32
+quantizer = None
+if os.environ.get("EMBEDDING_QUANTIZATION", "0") == "1":
+    if os.path.exists(QUANTIZER_FILE):
+        quantizer = ScalarQuantizer.load(QUANTIZER_FILE)
+    else:
+        print(f"EMBEDDING_QUANTIZATION is set but {QUANTIZER_FILE} is missing; searching in float32")
+# CODE_WEIGHT > 0 fuses docstring similarity with similarity to the function bodies
+# embedded by `create_data.py --embed_code`: (1 - w) * doc + w * code
+code_weight = float(os.environ.get("CODE_WEIGHT", 0))
+# Loaded once at startup; each request only pulls rows committed since the last one
+embedding_store = EmbeddingStore(
+    DB_FILE,
+    quantizer=quantizer,
+    rescore=os.environ.get("EMBEDDING_RESCORE", "1") == "1",
+    code_weight=code_weight,
 )
+embedding_store.refresh()
+# Optional ANN index from `create_data.py --build_ivf` (IVF_NPROBE trades recall for
+# latency) or `--build_pq` with ANN_INDEX=pq; ANN_INDEX=none always scans the matrix
+ann_index_choice = os.environ.get("ANN_INDEX", "ivf") if not embedding_store.hybrid else "none"
+if ann_index_choice == "ivf" and quantizer is not None and os.path.exists(IVF_INDEX_FILE):
+    # The IVF lists are float32 copies, so scanning them would undo the quantization
+    print("EMBEDDING_QUANTIZATION is set; not using the IVF index (ANN_INDEX=pq for an approximate index)")
+    ann_index_choice = "none"
+if ann_index_choice == "ivf" and os.path.exists(IVF_INDEX_FILE):
+    embedding_store.attach_index(IVFIndex.load(IVF_INDEX_FILE))
+elif ann_index_choice == "pq" and os.path.exists(PQ_INDEX_FILE):
+    embedding_store.attach_index(PQIndex.load(PQ_INDEX_FILE))
+ivf_n_probe = int(os.environ.get("IVF_NPROBE", 0)) or None
+# BM25=1 adds identifier matches from `create_data.py --build_bm25`: the dense and
+# BM25 candidates are merged by reciprocal-rank fusion
+lexical_index = LexicalIndex(DB_FILE) if os.environ.get("BM25", "0") == "1" else None
+# Retrieval cascade: CASCADE_K1 candidates from the index, re-scored in float32
+# (CASCADE_RESCORE=exact, skipped when retrieval was already exact), with code
+# vectors (code) or not at all (none) down to
+# CASCADE_K2 shown results, of which the top CASCADE_K3 are scored by the LLM.
+# With CODE_WEIGHT set the re-score keeps the code similarity in the blend.
+search_cascade = SearchCascade(
+    embedding_store,
+    lexical_index=lexical_index,
+    k1=int(os.environ.get("CASCADE_K1", 200)),
+    k2=int(os.environ.get("CASCADE_K2", 10)),
+    k3=int(os.environ.get("CASCADE_K3", 10)),
+    rescore_mode=os.environ.get("CASCADE_RESCORE", "code" if embedding_store.hybrid else "exact"),
+    code_weight=float(os.environ.get("CASCADE_CODE_WEIGHT", code_weight or 0.3)),
+    n_probe=ivf_n_probe,
+)
+
 #handles flag calls for dev mode, could be expanded to accept different model flags if needed
 if(sys.argv[1] == '1'):
     model_choice = "deepseek-r1:1.5b"
@@ -50,116 +110,396 @@ You are an AI evaluating code snippets.
 - If unsure, provide your **best numerical estimate**.
 """
 
+# Batched scoring prompt: every candidate in one request, one score per line back
+BATCH_SCORING_PROMPT_TEMPLATE = """
+You are an AI evaluating code snippets.
+
+- Your task: Score each numbered snippet's relevance to the query.
+- **Return ONLY one line per snippet**, in the form `<snippet number>: <score>`.
+- Scores are integers between 0-10.
+- **DO NOT** explain your reasoning.
+- Example response for 3 snippets:
+1: 8
+2: 3
+3: 10
+
+### Query:
+{query}
+
+### Code Snippets:
+{snippets}
+
+### Response Format:
+- Exactly {count} lines, numbered 1 to {count}.
+- No additional text.
+"""
+
+# Concurrent re-ranking: LLM calls in flight across all requests, and seconds allowed per call
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 4))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 30))
+llm_executor = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY)
+# Keep-alive connections to the LLM, one per concurrent call by default
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", LLM_CONCURRENCY))
+llm = LLMClient(LLM_BASE_URL, LLM_API_KEY, pool_size=LLM_POOL_SIZE, timeout=LLM_TIMEOUT)
+# Seconds a search may take in total; once it passes, results keep the dense order
+# instead of waiting on the LLM. SEARCH_DEADLINE=0 waits for every score
+SEARCH_DEADLINE = float(os.environ.get("SEARCH_DEADLINE", 20))
+
+def search_deadline(seconds=None) -> Deadline:
+    seconds = SEARCH_DEADLINE if seconds is None else seconds
+    return Deadline(seconds if seconds > 0 else None)
+
+# How the top-10 is re-ranked, one of rankers.SCORING_MODES
+SCORING_MODE = os.environ.get("SCORING_MODE", "concurrent" if LLM_CONCURRENCY > 1 else "sequential")
+
+# How each per-snippet score is decoded: "text" parses the first 0-10 integer from a
+# free-form reply; "json" constrains decoding to {"score": <0-10>}, so a reasoning
+# model can't spend its tokens on <think> text first; "logprobs" decodes a single
+# token and takes the expected value over the "0".."10" candidates
+SCORE_FORMATS = ("text", "json", "logprobs")
+SCORE_FORMAT = os.environ.get("SCORE_FORMAT", "json" if model_choice.startswith("deepseek-r1") else "text")
+if SCORE_FORMAT not in SCORE_FORMATS:
+    raise ValueError(f"Unknown score format {SCORE_FORMAT!r}, expected one of {SCORE_FORMATS}")
+SCORE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {"score": {"type": "integer", "minimum": 0, "maximum": 10}},
+    "required": ["score"],
+}
+SCORE_TOP_LOGPROBS = 20
+
+# Scores are cached per (model, variant, query, snippet): per-snippet scores under their
+# SCORE_FORMAT (logprobs are fractional), batched-prompt scores apart from both.
+# SCORE_CACHE=0 always asks the LLM
+SINGLE_SCORE_VARIANT = SCORE_FORMAT
+BATCH_SCORE_VARIANT = "batched"
+score_cache = ScoreCache(SCORE_CACHE_FILE) if os.environ.get("SCORE_CACHE", "1") != "0" else None
+
 #generator = pipeline("text-generation", model="llama2")
 
-def evaluate_snippet(user_input: str, snippet: str, retries=3):
-    """Evaluates a snippet locally using a text generation model to score its relevance."""
+def parse_score(choice):
+    """First integer between 0 and 10 in the reply; None if there is none."""
+    match = re.search(r'\b([0-9]|10)\b', reply_text(choice))
+    if match is None:
+        return None
+    return float(max(0, min(10, float(match.group(1)))))
+
+def parse_json_score(choice):
+    """The score field of a {"score": n} reply; None if the JSON is cut off or malformed."""
+    try:
+        score = json.loads(reply_text(choice))["score"]
+    except (ValueError, KeyError, TypeError):
+        return None
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return None
+    return float(max(0, min(10, score)))
+
+def parse_logprob_score(choice):
+    """Expected score over the numeric candidates for the first token; None if there are none.
+
+    Tokenizers that split "10" into "1" "0" fold its probability into 1.
+    """
+    if choice.logprobs is None or not choice.logprobs.content:
+        return None
+    probabilities = {}
+    for candidate in choice.logprobs.content[0].top_logprobs:
+        token = candidate.token.strip()
+        if token.isdigit() and int(token) <= 10:
+            probabilities[int(token)] = probabilities.get(int(token), 0.0) + math.exp(candidate.logprob)
+    total = sum(probabilities.values())
+    if total == 0:
+        return None
+    return sum(score * p for score, p in probabilities.items()) / total
+
+SCORE_PARSERS = {"text": parse_score, "json": parse_json_score, "logprobs": parse_logprob_score}
+
+def score_request(score_format=SCORE_FORMAT) -> dict:
+    """max_tokens and decoding options for one per-snippet score."""
+    if score_format == "json":
+        # {"score": 10} is about seven tokens
+        return {
+            "max_tokens": 16,
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "score", "schema": SCORE_JSON_SCHEMA, "strict": True},
+            },
+        }
+    if score_format == "logprobs":
+        return {"max_tokens": 1, "logprobs": True, "top_logprobs": SCORE_TOP_LOGPROBS}
+    return {"max_tokens": 10}
+
+def scoring_messages(user_input: str, snippet: str, score_format=SCORE_FORMAT) -> list:
     prompt = SCORING_PROMPT_TEMPLATE.format(query=user_input, snippet=snippet)
-    
-    for attempt in range(retries):
-        print(f"\n--- Local Model Inference (Attempt {attempt + 1}) ---")
-        print(f"Prompt (truncated): {prompt[:200]}...")
-        
-        try:
-            # The max_length should be set to limit the output to a few tokens.
-            completion = client.chat.completions.create(
-                model=model_choice,
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": snippet}],
-                temperature=0.2,
-                max_tokens=10
-            )
-
-            generated_text = completion.choices[0].message.content
-            print("\n--- Model Output ---")
-            print(generated_text)
-            
-            # We expect only a number: try extracting the first integer between 0 and 10.
-            match = re.search(r'\b([0-9]|10)\b', generated_text)
-            if match:
-                score = float(match.group(1))
-                print(f"Extracted Score: {score}")
-                return max(0, min(10, score))
-            else:
-                print(f"Warning: Unable to find score in output (Attempt {attempt + 1}). Retrying...")
-                time.sleep(1)
-                continue
-        
-        except Exception as e:
-            print(f"Error during local inference (Attempt {attempt + 1}): {e}")
-            time.sleep(1)
-            continue
-
-    print("Final Warning: No valid score after multiple attempts. Returning score 0.")
-    return 0  # Default fallback score
-
-
-def evaluate_snippet_no_print(user_input: str, snippet: str, retries=3):
+    if score_format == "json":
+        prompt += '\nRespond with JSON of the form {"score": <integer 0-10>}.\n'
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": snippet}]
+
+def finish_score(user_input: str, snippet: str, score, deadline: Deadline):
+    """Caches a parsed score. A failed call scores 0, unless the deadline ran out (None)."""
+    if score is None:
+        if deadline.expired():
+            return None
+        print("Final Warning: No valid score after multiple attempts. Returning score 0.")
+        return 0  # Default fallback score
+    print(f"Extracted Score: {score}")
+    if score_cache is not None:
+        score_cache.put(model_choice, user_input, snippet, score, SINGLE_SCORE_VARIANT)
+    return score
+
+def evaluate_snippet(user_input: str, snippet: str, retries=3, timeout=None, deadline=NO_DEADLINE):
     """Evaluates a snippet locally using a text generation model to score its relevance."""
-    prompt = SCORING_PROMPT_TEMPLATE.format(query=user_input, snippet=snippet)
+    if score_cache is not None:
+        cached_score = score_cache.get(model_choice, user_input, snippet, SINGLE_SCORE_VARIANT)
+        if cached_score is not None:
+            return cached_score
+    messages = scoring_messages(user_input, snippet)
+    print("\n--- Local Model Inference ---")
+    print(f"Prompt (truncated): {messages[0]['content'][:200]}...")
 
-    for attempt in range(retries):
+    def parse_verbose(choice):
+        print("\n--- Model Output ---")
+        print(reply_text(choice))
+        return SCORE_PARSERS[SCORE_FORMAT](choice)
 
-        try:
-            # The max_length should be set to limit the output to a few tokens.
-            completion = client.chat.completions.create(
-                model=model_choice,
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": snippet}],
-                temperature=0.2,
-                max_tokens=10
-            )
-
-            generated_text = completion.choices[0].message.content
-
-            # We expect only a number: try extracting the first integer between 0 and 10.
-            match = re.search(r'\b([0-9]|10)\b', generated_text)
-            if match:
-                score = float(match.group(1))
-                print(f"Extracted Score: {score}")
-                return max(0, min(10, score))
-            else:
-                print(f"Warning: Unable to find score in output (Attempt {attempt + 1}). Retrying...")
-                time.sleep(1)
-                continue
-
-        except Exception as e:
-            print(f"Error during local inference (Attempt {attempt + 1}): {e}")
-            time.sleep(1)
-            continue
-
-    print("Final Warning: No valid score after multiple attempts. Returning score 0.")
-    return 0  # Default fallback score
-
-def rank_snippets(user_input: str, snippets: list):
-    scored_snippets = [(snippet, evaluate_snippet(user_input, snippet)) for snippet in snippets]
-    scored_snippets.sort(key=lambda x: x[1], reverse=True)
-    return scored_snippets
+    # The max_tokens should be set to limit the output to a few tokens.
+    score = llm.complete(
+        model_choice, messages, parse=parse_verbose,
+        retries=retries, timeout=timeout, deadline=deadline, **score_request()
+    )
+    return finish_score(user_input, snippet, score, deadline)
+
+
+def evaluate_snippet_no_print(user_input: str, snippet: str, retries=3, timeout=None, deadline=NO_DEADLINE):
+    """Evaluates a snippet locally using a text generation model to score its relevance."""
+    if score_cache is not None:
+        cached_score = score_cache.get(model_choice, user_input, snippet, SINGLE_SCORE_VARIANT)
+        if cached_score is not None:
+            return cached_score
+    score = llm.complete(
+        model_choice, scoring_messages(user_input, snippet), parse=SCORE_PARSERS[SCORE_FORMAT],
+        retries=retries, timeout=timeout, deadline=deadline, **score_request()
+    )
+    return finish_score(user_input, snippet, score, deadline)
 
-def rank_snippets_no_print(user_input: str, snippets: list):
-    scored_snippets = [(snippet, evaluate_snippet_no_print(user_input, snippet)) for snippet in snippets]
+def sort_by_score(snippets: list, scores: list):
+    """(snippet, score) pairs best first, or in dense order if any score missed the deadline."""
+    scored_snippets = list(zip(snippets, scores))
+    missing = sum(score is None for score in scores)
+    if missing:
+        print(f"Search deadline passed with {missing} of {len(snippets)} snippets unscored; keeping the dense order.")
+        return scored_snippets
     scored_snippets.sort(key=lambda x: x[1], reverse=True)
     return scored_snippets
 
+def rank_snippets(user_input: str, snippets: list, deadline=NO_DEADLINE):
+    scores = [evaluate_snippet(user_input, snippet, deadline=deadline) for snippet in snippets]
+    return sort_by_score(snippets, scores)
+
+def rank_snippets_no_print(user_input: str, snippets: list, deadline=NO_DEADLINE):
+    scores = [evaluate_snippet_no_print(user_input, snippet, deadline=deadline) for snippet in snippets]
+    return sort_by_score(snippets, scores)
+
+def rank_snippets_concurrent(user_input: str, snippets: list, timeout=LLM_TIMEOUT, deadline=NO_DEADLINE):
+    """Scores all snippets in parallel on the shared LLM pool; same sorted output as rank_snippets."""
+    futures = [
+        llm_executor.submit(evaluate_snippet_no_print, user_input, snippet, timeout=timeout, deadline=deadline)
+        for snippet in snippets
+    ]
+    # Calls still running at the deadline finish on their own; their scores are not waited for
+    done, _ = wait(futures, timeout=deadline.wait_timeout())
+    scores = [future.result() if future in done else None for future in futures]
+    return sort_by_score(snippets, scores)
+
+def format_numbered_snippets(snippets: list) -> str:
+    return "\n\n".join(
+        f"#### Snippet {number}:\n```\n{snippet}\n```" for number, snippet in enumerate(snippets, 1)
+    )
+
+
+def parse_batch_scores(generated_text: str, count: int):
+    """Reads `<number>: <score>` lines. Returns None unless every snippet got a score."""
+    scores = {}
+    for number, score in re.findall(
+        r'^\W*(?:snippet\s*)?(\d+)\W*[:=\-]\s*(\d+)', generated_text or "", re.MULTILINE | re.IGNORECASE
+    ):
+        number, score = int(number), float(score)
+        if 1 <= number <= count and number not in scores:
+            scores[number] = float(max(0, min(10, score)))
+    if len(scores) != count:
+        return None
+    return [scores[number] for number in range(1, count + 1)]
+
+
+def batch_scoring_messages(user_input: str, snippets: list) -> list:
+    prompt = BATCH_SCORING_PROMPT_TEMPLATE.format(
+        query=user_input, snippets=format_numbered_snippets(snippets), count=len(snippets)
+    )
+    return [{"role": "user", "content": prompt}]
+
+
+def evaluate_snippets_batched(user_input: str, snippets: list, retries=1, timeout=None, deadline=NO_DEADLINE):
+    """Scores every snippet with a single chat completion. Returns None if the reply can't be parsed."""
+    return llm.complete(
+        model_choice,
+        batch_scoring_messages(user_input, snippets),
+        max_tokens=8 * len(snippets) + 16,
+        parse=lambda choice: parse_batch_scores(reply_text(choice), len(snippets)),
+        retries=retries,
+        timeout=timeout,
+        deadline=deadline,
+    )
+
+
+def rank_snippets_batched(user_input: str, snippets: list, timeout=LLM_TIMEOUT, deadline=NO_DEADLINE):
+    """Scores all snippets in one prompt, falling back to per-snippet scoring if parsing fails.
+
+    Snippets with a cached score are left out of the prompt.
+    """
+    scores = [None] * len(snippets)
+    if score_cache is not None:
+        scores = [score_cache.get(model_choice, user_input, snippet, BATCH_SCORE_VARIANT) for snippet in snippets]
+    uncached = [i for i, score in enumerate(scores) if score is None]
+
+    if uncached:
+        new_scores = evaluate_snippets_batched(
+            user_input, [snippets[i] for i in uncached], timeout=timeout, deadline=deadline
+        )
+        if new_scores is None:
+            if deadline.expired():
+                return sort_by_score(snippets, scores)
+            print("Falling back to per-snippet scoring.")
+            if LLM_CONCURRENCY > 1:
+                return rank_snippets_concurrent(user_input, snippets, timeout=timeout, deadline=deadline)
+            return rank_snippets_no_print(user_input, snippets, deadline=deadline)
+        for i, score in zip(uncached, new_scores):
+            scores[i] = score
+            if score_cache is not None:
+                score_cache.put(model_choice, user_input, snippets[i], score, BATCH_SCORE_VARIANT)
+
+    return sort_by_score(snippets, scores)
+
+
+def rank_snippets_by_mode(user_input: str, snippets: list, mode=SCORING_MODE, verbose=False, deadline=NO_DEADLINE):
+    """Dispatches to the re-ranker selected by SCORING_MODE (or --scoring_mode in benchmarking)."""
+    if mode == "batched":
+        return rank_snippets_batched(user_input, snippets, deadline=deadline)
+    if mode == "concurrent":
+        return rank_snippets_concurrent(user_input, snippets, deadline=deadline)
+    if mode != "sequential":
+        raise ValueError(f"Unknown scoring mode {mode!r}, expected one of {SCORING_MODES}")
+    if verbose:
+        return rank_snippets(user_input, snippets, deadline=deadline)
+    return rank_snippets_no_print(user_input, snippets, deadline=deadline)
+
+def iter_snippet_scores(user_input: str, snippets: list, mode=SCORING_MODE, deadline=NO_DEADLINE):
+    """Yields (index, score) for each snippet as soon as its score is known, until the deadline."""
+    if mode == "batched":
+        scores = dict(rank_snippets_batched(user_input, snippets, deadline=deadline))
+        for index, snippet in enumerate(snippets):
+            if scores[snippet] is not None:
+                yield index, scores[snippet]
+    elif mode == "concurrent":
+        futures = {
+            llm_executor.submit(
+                evaluate_snippet_no_print, user_input, snippet, timeout=LLM_TIMEOUT, deadline=deadline
+            ): index
+            for index, snippet in enumerate(snippets)
+        }
+        try:
+            for future in as_completed(futures, timeout=deadline.wait_timeout()):
+                if future.result() is not None:
+                    yield futures[future], future.result()
+        except FutureTimeoutError:
+            return
+    elif mode == "sequential":
+        for index, snippet in enumerate(snippets):
+            score = evaluate_snippet_no_print(user_input, snippet, deadline=deadline)
+            if score is None:
+                return
+            yield index, score
+    else:
+        raise ValueError(f"Unknown scoring mode {mode!r}, expected one of {SCORING_MODES}")
+
+# What re-ranks the top CASCADE_K3: the LLM, or RERANKER=cross_encoder for the
+# UniXcoder cross-encoder at CROSS_ENCODER_CHECKPOINT, trained with
+# `benchmarking.py --do_train_cross_encoder`. It scores all snippets in one forward pass.
+RERANKER = os.environ.get("RERANKER", "llm")
+if RERANKER not in RANKERS:
+    raise ValueError(f"Unknown reranker {RERANKER!r}, expected one of {RANKERS}")
+if RERANKER == "cross_encoder":
+    if "CROSS_ENCODER_CHECKPOINT" not in os.environ:
+        raise ValueError("RERANKER=cross_encoder needs CROSS_ENCODER_CHECKPOINT set to a trained model.bin")
+    ranker = CrossEncoderRanker(CrossEncoder.load(os.environ["CROSS_ENCODER_CHECKPOINT"], device=device))
+else:
+    ranker = LLMRanker(rank_snippets_by_mode, iter_snippet_scores, verbose=True)
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.route("/", methods=["GET", "POST"])
 def search_page():
     initial_results = None
     llm_results = None
     if request.method == "POST":
-        with sqlite3.connect(DB_FILE) as conn:
-            cursor = conn.cursor()
-            user_input = request.form["code_description"]
-            processed_data = get_processed_data(cursor)
-            processed_user_code = process_user_code_segment(user_input)
-            top_ten_indices = get_top_ten(processed_user_code, processed_data)
-
-            initial_results = [(processed_data[index][0], score) for index, score in top_ten_indices]
-            top_ten_snippets = [snippet for snippet, _ in initial_results]
-            llm_results = rank_snippets(user_input, top_ten_snippets)
-
-    return render_template("index.html", initial_results=initial_results, llm_results=llm_results)
+        user_input = request.form["code_description"]
+        deadline = search_deadline()
+        embedding_store.refresh()
+        result = search_cascade.run(
+            user_input,
+            process_user_code_segment,
+            lambda query, snippets: ranker.rank(query, snippets, deadline=deadline),
+        )
+        initial_results = result.snippets
+        llm_results = result.llm_results
+        print("Stage latencies (ms): " + ", ".join(f"{stage}={ms:.1f}" for stage, ms in result.timings.items()))
+        if score_cache is not None:
+            print(f"Score cache: {score_cache.stats()}")
+
+    return render_template(
+        "index.html", initial_results=initial_results, llm_results=llm_results, ranker_label=ranker.label
+    )
+
+@app.route("/stream")
+def stream_page():
+    """Server-sent events: the cascade's results first, then each re-ranker score as it arrives."""
+    user_input = request.args.get("code_description", "")
+    deadline = search_deadline()
+
+    def generate():
+        embedding_store.refresh()
+        result = search_cascade.prepare(user_input, process_user_code_segment)
+        llm_snippets = search_cascade.llm_snippets(result)
+        yield sse_event("results", {
+            "snippets": [{"snippet": snippet, "score": float(score)} for snippet, score in result.snippets],
+            "llm_count": len(llm_snippets),
+        })
+        started = time.perf_counter()
+        scored = 0
+        for index, score in ranker.iter_scores(user_input, llm_snippets, deadline=deadline):
+            scored += 1
+            yield sse_event("score", {"index": index, "score": float(score)})
+        search_cascade.record(result, 1000 * (time.perf_counter() - started))
+        print("Stage latencies (ms): " + ", ".join(f"{stage}={ms:.1f}" for stage, ms in result.timings.items()))
+        # complete is false when the deadline cut the re-ranking stage short
+        yield sse_event("done", {"timings": result.timings, "complete": scored == len(llm_snippets)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Proxies must not buffer the stream or the first event arrives with the last
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/metrics")
+def metrics_page():
+    return jsonify(
+        embedding_batcher=embedding_batcher.metrics(),
+        query_cache={"hits": query_cache.hits, "misses": query_cache.misses},
+        score_cache=score_cache.stats() if score_cache is not None else None,
+        cascade=search_cascade.metrics(),
+        llm=llm.stats(),
+    )
 
 if __name__ == "__main__":
     app.run(debug=True,port=5002)
@@ -1,20 +1,40 @@
 # Waits for some text input. Returns similiar code snippets from the training data.
 
+import os
 import sqlite3
 from typing import List, Tuple
 
 import numpy as np
-import torch
+from unixcoder import top_k_indices
 
-from data_processing import  init_model
+from data_processing import MODEL_NAME, init_model
+from embedding_service import EmbeddingBatcher
+from query_cache import QUERY_CACHE_FILE, QueryEmbeddingCache, normalize_query
 
 model, device, HAS_GPU = init_model()
 
+# Repeated queries skip the forward pass; QUERY_CACHE_DISK=1 also keeps them across restarts
+query_cache = QueryEmbeddingCache(
+    max_entries=int(os.environ.get("QUERY_CACHE_SIZE", 1024)),
+    disk_file=QUERY_CACHE_FILE if os.environ.get("QUERY_CACHE_DISK") == "1" else None,
+)
+
+# Concurrent cache misses share one padded forward pass per micro-batch
+embedding_batcher = EmbeddingBatcher(
+    model,
+    device,
+    max_batch_size=int(os.environ.get("EMBED_BATCH_SIZE", 16)),
+    max_wait_ms=float(os.environ.get("EMBED_BATCH_WAIT_MS", 5)),
+)
+
 
 def get_processed_data(cursor: sqlite3.Cursor) -> List[Tuple[str, np.ndarray]]:
     """Loads code snippets and their embeddings from SQLite into memory."""
     try:
-        cursor.execute("SELECT code_string, embedding FROM embeddings")
+        cursor.execute(
+            "SELECT c.code_string, e.embedding FROM embeddings e "
+            "JOIN code_strings c ON c.id = e.id"
+        )
         processed_data = []
         for code_string, blob in cursor:
             if blob is None:
@@ -27,21 +47,22 @@ def get_processed_data(cursor: sqlite3.Cursor) -> List[Tuple[str, np.ndarray]]:
         return []
 
 
-def process_user_code_segment(user_input: str) -> np.ndarray:
-    # Encode user-given description
-    tokens_ids = model.tokenize([user_input], max_length=512, mode="<encoder-only>")
-    source_ids = torch.tensor(tokens_ids).to(device)
-
-    # Get embeddings from the model
-    _, nl_embedding = model(source_ids)
+def process_user_code_segment(user_input: str, max_length: int = 512) -> np.ndarray:
+    key = query_cache.key(MODEL_NAME, max_length, user_input)
+    cached = query_cache.get(key)
+    if cached is not None:
+        return cached
 
-    # Detach, normalize, move to CPU, and flatten
-    return (
-        torch.flatten(torch.nn.functional.normalize(nl_embedding.detach(), p=2, dim=1))
-        .cpu()
-        .numpy()
+    # Encode user-given description
+    tokens_ids = model.tokenize(
+        [normalize_query(user_input)], max_length=max_length, mode="<encoder-only>"
     )
 
+    # Runs in inference mode, batched with whatever other queries arrive in the same window
+    embedding = embedding_batcher.encode(tokens_ids[0])
+    query_cache.put(key, embedding)
+    return embedding
+
 
 def get_top_ten(
     query_embedding: np.ndarray, processed_data: List[Tuple[str, np.ndarray]]
@@ -56,7 +77,7 @@ def get_top_ten(
     scores = np.dot(all_embeddings, query_embedding)
 
     # Get top 10 indices sorted by highest similarity
-    top_indices = np.argsort(scores)[::-1][:10]
+    top_indices = top_k_indices(scores, 10)
     print("TOP_INDICES", top_indices)
 
     # Return the top 10 (index, score) pairs
@@ -0,0 +1,104 @@
+# SQLite storage layer for the embeddings database.
+#
+# Every connection runs in WAL mode, so the indexer can commit while search workers
+# read without "database is locked" stalls. Vectors and code text live in separate
+# tables: scans over `embeddings` only touch the fixed-size BLOB pages, and the code
+# text is fetched by id for the handful of results that are shown. The optional
+# code_embeddings table holds embeddings of the function bodies themselves.
+
+import sqlite3
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+DB_FILE = "embeddings.db"
+
+# Five 768-d float32 vectors per page; only applies to a database that has no tables yet
+PAGE_SIZE = 16384
+MMAP_SIZE = 1 << 30
+CACHE_SIZE_KIB = 64 * 1024
+BUSY_TIMEOUT = 30.0
+
+# Constant SQL text lets sqlite3's statement cache reuse one prepared statement
+INSERT_EMBEDDING_SQL = "INSERT INTO embeddings (id, embedding) VALUES (?, ?)"
+INSERT_CODE_STRING_SQL = "INSERT INTO code_strings (id, code_string) VALUES (?, ?)"
+INSERT_CODE_EMBEDDING_SQL = "INSERT INTO code_embeddings (id, embedding) VALUES (?, ?)"
+
+
+def apply_pragmas(conn: sqlite3.Connection):
+    conn.execute(f"PRAGMA page_size = {PAGE_SIZE}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    # NORMAL is durable across application crashes in WAL mode; only an OS crash can lose the last commits
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def connect(db_file: str = DB_FILE, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Opens the embeddings database with the tuned pragmas applied."""
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread)
+    apply_pragmas(conn)
+    return conn
+
+
+def create_schema(cursor: sqlite3.Cursor):
+    """Creates the vector and code text tables, migrating the old single-table layout."""
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS embeddings (
+            id INTEGER PRIMARY KEY,
+            embedding BLOB
+        )"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS code_strings (
+            id INTEGER PRIMARY KEY,
+            code_string TEXT
+        )"""
+    )
+    cursor.execute(
+        """CREATE TABLE IF NOT EXISTS code_embeddings (
+            id INTEGER PRIMARY KEY,
+            embedding BLOB
+        )"""
+    )
+    migrate_code_strings(cursor)
+
+
+def migrate_code_strings(cursor: sqlite3.Cursor):
+    """Moves code_string out of an embeddings table created before the split."""
+    cursor.execute("PRAGMA table_info(embeddings)")
+    if "code_string" not in [row[1] for row in cursor.fetchall()]:
+        return
+    print("Migrating code_string text out of the embeddings table...")
+    cursor.execute(
+        "INSERT OR IGNORE INTO code_strings (id, code_string) SELECT id, code_string FROM embeddings"
+    )
+    cursor.execute("CREATE TABLE embeddings_split (id INTEGER PRIMARY KEY, embedding BLOB)")
+    cursor.execute("INSERT INTO embeddings_split (id, embedding) SELECT id, embedding FROM embeddings")
+    cursor.execute("DROP TABLE embeddings")
+    cursor.execute("ALTER TABLE embeddings_split RENAME TO embeddings")
+    cursor.connection.commit()
+
+
+def insert_entries(entries: List[Tuple[int, str, np.ndarray]], cursor: sqlite3.Cursor):
+    """Bulk-inserts (id, code_string, embedding) entries into both tables."""
+    cursor.executemany(INSERT_EMBEDDING_SQL, [(i, emb.tobytes()) for i, _, emb in entries])
+    cursor.executemany(INSERT_CODE_STRING_SQL, [(i, code) for i, code, _ in entries])
+
+
+def insert_code_embeddings(entries: List[Tuple[int, np.ndarray]], cursor: sqlite3.Cursor):
+    """Bulk-inserts (id, code embedding) entries."""
+    cursor.executemany(INSERT_CODE_EMBEDDING_SQL, [(i, emb.tobytes()) for i, emb in entries])
+
+
+def fetch_code_strings(cursor: sqlite3.Cursor, ids: List[int]) -> Dict[int, str]:
+    """Fetches code_string text for the given ids only."""
+    if not ids:
+        return {}
+    placeholders = ",".join("?" * len(ids))
+    cursor.execute(
+        f"SELECT id, code_string FROM code_strings WHERE id IN ({placeholders})",
+        [int(i) for i in ids],
+    )
+    return dict(cursor.fetchall())
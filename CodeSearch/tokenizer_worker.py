@@ -0,0 +1,25 @@
+# Tokenizer-only worker for the CPU indexing pipeline's process pool.
+# Only the tokenizer is loaded here so pool processes stay small.
+
+from typing import List
+
+from transformers import RobertaTokenizer
+
+_tokenizer = None
+
+
+def init_tokenizer(model_name: str):
+    """Process pool initializer: loads the same tokenizer UniXcoder uses."""
+    global _tokenizer
+    _tokenizer = RobertaTokenizer.from_pretrained(model_name)
+    _tokenizer.add_tokens(["<mask0>"], special_tokens=True)
+
+
+def tokenize_encoder_only(texts: List[str], max_length: int = 512) -> List[List[int]]:
+    """Same ids as UniXcoder.tokenize(texts, mode="<encoder-only>") without padding."""
+    tokens_ids = []
+    for text in texts:
+        tokens = _tokenizer.tokenize(text)[: max_length - 4]
+        tokens = [_tokenizer.cls_token, "<encoder-only>", _tokenizer.sep_token] + tokens + [_tokenizer.sep_token]
+        tokens_ids.append(_tokenizer.convert_tokens_to_ids(tokens))
+    return tokens_ids
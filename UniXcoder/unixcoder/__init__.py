@@ -1,3 +1,4 @@
 from .unixcoder import UniXcoder
+from .topk import blocked_top_k, rank_positions, top_k_indices
 
-__all__ = ['UniXcoder']
+__all__ = ['UniXcoder', 'blocked_top_k', 'rank_positions', 'top_k_indices']
@@ -37,6 +37,7 @@ from torch.utils.data import DataLoader, Dataset, SequentialSampler, RandomSampl
 from torch.utils.data.distributed import DistributedSampler
 
 from model import Model
+from unixcoder import blocked_top_k
 from transformers import (WEIGHTS_NAME, AdamW, get_linear_schedule_with_warmup,
                           RobertaConfig, RobertaModel, RobertaTokenizer)
 
@@ -230,16 +231,15 @@ def evaluate(args, model, tokenizer, data_file):
     eval_loss = eval_loss / nb_eval_steps
     perplexity = torch.tensor(eval_loss)
 
-    scores=np.matmul(vecs,vecs.T)
     dic={}
-    for i in range(scores.shape[0]):
-        scores[i,i] = -1000000
+    for i in range(vecs.shape[0]):
         if int(labels[i]) not in dic:
             dic[int(labels[i])] = -1
         dic[int(labels[i])] += 1
-    sort_ids = np.argsort(scores, axis=-1, kind='quicksort', order=None)[:,::-1]
+    # MAP only looks at the first dic[label] candidates, never past the largest class
+    sort_ids, _ = blocked_top_k(vecs, vecs, max(dic.values()), exclude_self=True)
     MAP = []
-    for i in range(scores.shape[0]):
+    for i in range(vecs.shape[0]):
         cont = 0
         label = int(labels[i])
         Avep = []
@@ -28,6 +28,7 @@ import torch
 import json
 import numpy as np
 from model import Model
+from unixcoder import blocked_top_k
 from torch.nn import CrossEntropyLoss, MSELoss
 from torch.utils.data import DataLoader, Dataset, SequentialSampler, RandomSampler, TensorDataset
 from transformers import (WEIGHTS_NAME, AdamW, get_linear_schedule_with_warmup,
@@ -254,10 +255,8 @@ def evaluate(args, model, tokenizer, file_name, eval_when_training=False):
     code_vecs = np.concatenate(code_vecs, 0)
     nl_vecs = np.concatenate(nl_vecs, 0)
 
-    scores = np.matmul(nl_vecs, code_vecs.T)
-
-    sort_ids = np.argsort(
-        scores, axis=-1, kind='quicksort', order=None)[:, ::-1]
+    # MRR only looks at the first 1000 candidates of each query
+    sort_ids, _ = blocked_top_k(nl_vecs, code_vecs, 1000)
 
     nl_urls = []
     code_urls = []
@@ -31,6 +31,7 @@ import json
 import numpy as np
 from tqdm import tqdm
 from model import Model
+from unixcoder import rank_positions
 from torch.nn import CrossEntropyLoss, MSELoss
 from torch.utils.data import DataLoader, Dataset, SequentialSampler, RandomSampler,TensorDataset
 from transformers import (WEIGHTS_NAME, AdamW, get_linear_schedule_with_warmup,
@@ -208,26 +209,32 @@ def evaluate(args, model, tokenizer, file_name, candidate_file_name):
     candidate_labels = list(np.concatenate(candidate_labels,0))
     candidate_indexs =[candidate_dataset.examples[i].index for i in range(len(candidate_dataset))]
     query_indexs = [query_dataset.examples[i].index for i in range(len(query_dataset))]
-    scores = np.matmul(query_vecs,candidate_vecs.T)
-    
-    # Calculate MAP score
-    sort_ids = np.argsort(scores, axis=-1, kind='quicksort', order=None)[:,::-1]
+    candidate_labels_array = np.array(candidate_labels).astype(int)
+    candidate_indexs_array = np.array(candidate_indexs)
+
+    # Calculate MAP score. Rather than sorting every row, count how many candidates
+    # outscore each relevant one; scores are computed in row blocks to bound memory.
     MAP=[]
     results = {}
-    for i in range(scores.shape[0]):
-        cont=0
-        label=int(query_labels[i])
-        query_index = query_indexs[i]
-        results[query_index] = [label,candidate_labels[sort_ids[i][0]],candidate_indexs[sort_ids[i][0]]]
-        Avep = []
-        for j,index in enumerate(list(sort_ids[i])):
-            if query_index==candidate_indexs[index]:
-                cont+=1
-                continue
-            if  int(candidate_labels[index])==label:
-                Avep.append((len(Avep)+1)/(j+1-cont))
-        if len(Avep)!=0:
-            MAP.append(sum(Avep)/len(Avep))
+    block_size = 1024
+    for start in range(0, query_vecs.shape[0], block_size):
+        block_scores = np.matmul(query_vecs[start:start+block_size],candidate_vecs.T)
+        for offset, row in enumerate(block_scores):
+            i = start + offset
+            label=int(query_labels[i])
+            query_index = query_indexs[i]
+            top_id = int(np.argmax(row))
+            results[query_index] = [label,candidate_labels[top_id],candidate_indexs[top_id]]
+
+            is_self = candidate_indexs_array == query_index
+            relevant = np.flatnonzero((candidate_labels_array == label) & ~is_self)
+            positions = np.sort(rank_positions(row, relevant))
+            # the query itself is skipped when it appears among the candidates
+            self_positions = rank_positions(row, np.flatnonzero(is_self))
+            positions -= (self_positions[:,None] < positions[None,:]).sum(0)
+            Avep = (np.arange(len(positions))+1)/(positions+1)
+            if len(Avep)!=0:
+                MAP.append(float(np.mean(Avep)))
    
     result = {
         "eval_map":float(np.mean(MAP))
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k largest scores along the last axis, best first.
+
+    Uses argpartition, so the cost is O(n + k log k) per row instead of the
+    O(n log n) of a full argsort.
+
+    Parameters:
+
+    * `scores`- 1-D score vector or 2-D (queries x candidates) score matrix.
+    * `k`- number of indices to keep per row; clipped to the number of candidates.
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(scores, n - k, axis=-1)[..., n - k:]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(candidate_scores, axis=-1)[..., ::-1]
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def blocked_top_k(queries, candidates, k, block_size=1024, exclude_self=False):
+    """
+    Top-k candidates by dot product for every query, computed in row blocks.
+
+    Only a (block_size x num_candidates) score block is alive at a time, so memory
+    stays bounded for large codebases.
+
+    Parameters:
+
+    * `queries`- (num_queries x dim) matrix.
+    * `candidates`- (num_candidates x dim) matrix.
+    * `k`- number of candidates to keep per query.
+    * `block_size`- number of query rows scored at once.
+    * `exclude_self`- never return candidate i for query i (queries and candidates are the same set).
+
+    Returns (indices, scores), both (num_queries x k), best first.
+    """
+    k = min(k, len(candidates))
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    top_scores = np.empty((len(queries), k), dtype=np.float32)
+    for start in range(0, len(queries), block_size):
+        block = np.matmul(queries[start:start + block_size], candidates.T)
+        if exclude_self:
+            rows = np.arange(len(block))
+            block[rows, start + rows] = -np.inf
+        block_indices = top_k_indices(block, k)
+        indices[start:start + len(block)] = block_indices
+        top_scores[start:start + len(block)] = np.take_along_axis(block, block_indices, axis=-1)
+    return indices, top_scores
+
+
+def rank_positions(scores, targets, chunk_size=256):
+    """
+    0-based positions the `targets` columns would take in a descending sort of a 1-D
+    score vector, found by counting higher scores instead of sorting. O(n * len(targets)).
+
+    Parameters:
+
+    * `scores`- 1-D score vector.
+    * `targets`- indices into `scores`.
+    """
+    scores = np.asarray(scores)
+    targets = np.asarray(targets, dtype=np.int64)
+    target_scores = scores[targets]
+    order = np.argsort(-target_scores, kind="stable")
+    greater = np.empty(len(targets), dtype=np.int64)
+    for start in range(0, len(targets), chunk_size):
+        chunk = target_scores[order[start:start + chunk_size]]
+        greater[start:start + len(chunk)] = (scores[None, :] > chunk[:, None]).sum(-1)
+    # Targets with tied scores still occupy distinct positions
+    positions = np.empty(len(targets), dtype=np.int64)
+    positions[order] = np.maximum(greater, np.arange(len(targets)))
+    return positions